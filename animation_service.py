@@ -0,0 +1,161 @@
+"""
+Animation Service
+Turns a session's frames into a boomerang GIF or MP4 next to the archive, on a background worker
+"""
+
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import subprocess
+import time
+import logging
+from PIL import Image
+from prometheus_client import Counter, Histogram
+
+logger = logging.getLogger('AnimationService')
+logger.setLevel(logging.INFO)
+
+ANIMATION_SECONDS = Histogram(
+    'animation_encode_seconds', 'Time to build one animation per format', ['format'],
+    buckets=(0.5, 1, 2, 3, 5, 8, 12, 20, 30, 60)
+)
+ANIMATIONS = Counter('animations_total', 'Animations built per format and outcome', ['format', 'result'])
+
+FORMATS = ('gif', 'mp4')
+
+
+def boomerang(items):
+    """Forward then backward without repeating the turning points: 1 2 3 4 3 2."""
+    return list(items) + list(items)[-2:0:-1]
+
+
+class AnimationService:
+    def __init__(self, output_directory='archive', output_format='gif', size=800, frame_seconds=0.4, loops=3, fps=25):
+        """
+        Args:
+            output_format (str): 'gif', or 'mp4' which needs ffmpeg and falls back to gif without it.
+            size (int): Longest side of the animation in pixels.
+            frame_seconds (float): How long each frame is shown.
+            loops (int): Boomerang repetitions in an MP4, a GIF loops forever by itself.
+            fps (int): MP4 output frame rate.
+        """
+        if output_format not in FORMATS:
+            raise ValueError(f"Unknown animation format '{output_format}', expected one of {', '.join(FORMATS)}")
+        if output_format == 'mp4' and not shutil.which('ffmpeg'):
+            logger.warning("ffmpeg not found, writing GIF animations instead of MP4")
+            output_format = 'gif'
+        self.output_directory = output_directory
+        self.output_format = output_format
+        self.size = size
+        self.frame_seconds = frame_seconds
+        self.loops = loops
+        self.fps = fps
+        self.work_queue = queue.Queue()
+        os.makedirs(self.output_directory, exist_ok=True)
+        # One worker, animations are never urgent and must not compete with the next session
+        threading.Thread(target=self._worker, name='animation-worker', daemon=True).start()
+
+    def submit(self, session):
+        """
+        Queue an animation of the session's frames.
+
+        The frames are hard linked into a work directory first, so the session can remove its
+        files as usual while the animation is still waiting for the worker.
+        """
+        work_directory = tempfile.mkdtemp(prefix='.animation_', dir=self.output_directory)
+        frames = []
+        try:
+            for index, path in enumerate(session.frames):
+                link_path = os.path.join(work_directory, f"frame_{index}{os.path.splitext(path)[1]}")
+                try:
+                    os.link(path, link_path)
+                except OSError:
+                    # Different filesystem
+                    shutil.copy2(path, link_path)
+                frames.append(link_path)
+        except Exception as e:
+            logger.error(f"Error preparing animation for session {session.session_id}: {e}")
+            shutil.rmtree(work_directory, ignore_errors=True)
+            return
+        output_path = os.path.join(self.output_directory, f"animation_{session.session_id}.{self.output_format}")
+        self.work_queue.put((frames, work_directory, output_path))
+
+    def _worker(self):
+        while True:
+            frames, work_directory, output_path = self.work_queue.get()
+            start_time = time.time()
+            try:
+                small_frames = self._downscale(frames)
+                if self.output_format == 'mp4':
+                    self._write_mp4(small_frames, output_path)
+                else:
+                    self._write_gif(small_frames, output_path)
+                ANIMATION_SECONDS.labels(format=self.output_format).observe(time.time() - start_time)
+                ANIMATIONS.labels(format=self.output_format, result='success').inc()
+                logger.info(f"Animation written to {output_path} in {time.time() - start_time:.1f}s")
+            except Exception as e:
+                ANIMATIONS.labels(format=self.output_format, result='failure').inc()
+                logger.error(f"Error creating animation {output_path}: {e}")
+            finally:
+                shutil.rmtree(work_directory, ignore_errors=True)
+
+    def _downscale(self, frames):
+        """Decode each frame once at reduced size and keep only the small copy on disk."""
+        small_frames = []
+        for path in frames:
+            small_path = os.path.splitext(path)[0] + '_small.jpg'
+            with Image.open(path) as image:
+                image.draft('RGB', (self.size, self.size))
+                image = image.convert('RGB')
+                image.thumbnail((self.size, self.size), Image.BILINEAR)
+                # Even sizes, yuv420p cannot encode odd widths or heights
+                image = image.crop((0, 0, image.width // 2 * 2, image.height // 2 * 2))
+                image.save(small_path, quality=90)
+            os.remove(path)
+            small_frames.append(small_path)
+        return small_frames
+
+    def _frames(self, small_frames, convert=None):
+        """Yield the boomerang sequence, opening one small frame at a time."""
+        for path in boomerang(small_frames):
+            with Image.open(path) as image:
+                image = image.convert('RGB')
+            yield convert(image) if convert else image
+
+    def _write_gif(self, small_frames, output_path):
+        # Pillow keeps the frames it has written to compare them, quantised they take a third of the memory
+        frames = self._frames(small_frames, lambda image: image.quantize(colors=256, method=Image.Quantize.FASTOCTREE))
+        first = next(frames)
+        temp_path = output_path + '.tmp'
+        first.save(temp_path, format='GIF', save_all=True, append_images=frames,
+                   duration=int(self.frame_seconds * 1000), loop=0)
+        os.replace(temp_path, output_path)
+
+    def _write_mp4(self, small_frames, output_path):
+        with Image.open(small_frames[0]) as image:
+            width, height = image.size
+        temp_path = output_path + '.tmp.mp4'
+        command = [
+            'nice', '-n', '10', 'ffmpeg', '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f"{width}x{height}", '-framerate', str(1 / self.frame_seconds), '-i', '-',
+            '-r', str(self.fps), '-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p', '-movflags', '+faststart',
+            temp_path,
+        ]
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            for _ in range(self.loops):
+                for image in self._frames(small_frames):
+                    process.stdin.write(image.tobytes())
+            process.stdin.close()
+            error = process.stderr.read().decode(errors='replace')
+            if process.wait() != 0:
+                raise RuntimeError(f"ffmpeg failed: {error.strip()}")
+        except Exception:
+            process.kill()
+            process.wait()
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        os.replace(temp_path, output_path)
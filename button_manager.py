@@ -1,17 +1,168 @@
+import time
+import queue
+import threading
 import logging
 from gpiozero import Button
+from prometheus_client import Counter, Histogram
 
 logger = logging.getLogger('ButtonManager')
 logger.setLevel(logging.INFO)
 
+BUTTON_EVENT_WAIT = Histogram(
+    'button_event_wait_seconds', 'Time from a button event to the start of its handler', ['gesture'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+BUTTON_EVENTS = Counter('button_events_total', 'Button events by gesture and outcome', ['gesture', 'result'])
+
+# Gestures that can have a handler besides the plain presses
+GESTURES = ('button1_held', 'button2_held', 'both_held')
+
+
 class ButtonManager:
-    def __init__(self, button1_callback, button2_callback=None, button1_pin=12, button2_pin=18):
-        self.button1 = Button(button1_pin)
-        self.button2 = Button(button2_pin) if button2_callback else None
-        self.button1.when_pressed = button1_callback
+    """
+    Turns GPIO edges into timestamped gesture events and runs their handlers on one worker thread.
+
+    gpiozero calls when_pressed and friends on its own callback thread. Handlers like
+    initiate_payment can block for seconds, so the callbacks here only timestamp the edge and
+    queue it, and a dispatcher thread runs the handlers in order.
+    """
+
+    def __init__(self, button1_callback, button2_callback=None, button1_pin=12, button2_pin=18,
+                 gestures=None, debounce_time=0.05, hold_time=3.0, max_event_age=10.0, chord_window=0.15):
+        """
+        Args:
+            gestures (dict): Handlers for 'button1_held', 'button2_held' (long press) and
+                'both_held' (both buttons held down), used for staff functions.
+            debounce_time (float): Presses on the same button closer together than this are ignored.
+            max_event_age (float): Events that waited longer than this for the dispatcher are dropped.
+            chord_window (float): With a 'both_held' handler, a press is dispatched this long after
+                it went down, unless the other button went down meanwhile and it may be the chord.
+        """
+        self.handlers = {'button1': button1_callback, 'button2': button2_callback}
+        self.handlers.update(gestures or {})
+        unknown = set(gestures or {}) - set(GESTURES)
+        if unknown:
+            raise ValueError(f"Unknown button gestures: {', '.join(sorted(unknown))}")
+        self.debounce_time = debounce_time
+        self.max_event_age = max_event_age
+        self.chord_window = chord_window
+        self.events = queue.Queue()
+        # gpiozero runs the callbacks of each button on its own thread
+        self.lock = threading.Lock()
+        self.last_press = {}
+        self.down = set()
+        self.deferred = set()     # presses that wait for the release to know they were not a gesture
+        self.fired = set()        # buttons whose current press already triggered a gesture
+        self.chord_pending = {}   # button -> (token, press time) of a press waiting out the chord window
+
+        self.button1 = Button(button1_pin, hold_time=hold_time)
+        self.button2 = Button(button2_pin, hold_time=hold_time) if button2_callback or gestures else None
+        self._wire(self.button1, 'button1')
         if self.button2:
-            self.button2.when_pressed = button2_callback
+            self._wire(self.button2, 'button2')
+
+        self.dispatcher_thread = threading.Thread(target=self._dispatch_loop, name='button-dispatcher', daemon=True)
+        self.dispatcher_thread.start()
+
+    def _wire(self, button, name):
+        button.when_pressed = lambda: self._on_pressed(name)
+        button.when_held = lambda: self._on_held(name)
+        button.when_released = lambda: self._on_released(name)
+
+    def _other(self, name):
+        return 'button2' if name == 'button1' else 'button1'
+
+    def _on_pressed(self, name):
+        now = time.monotonic()
+        with self.lock:
+            if now - self.last_press.get(name, 0) < self.debounce_time:
+                BUTTON_EVENTS.labels(gesture=name, result='debounced').inc()
+                return
+            self.last_press[name] = now
+            # A press still waiting for its chord window was not part of a chord
+            self._dispatch_chord_pending(name)
+            self.down.add(name)
+            other = self._other(name)
+
+            if self.handlers.get(f"{name}_held"):
+                # Only the release tells a press from a long press
+                self.deferred.add(name)
+            elif self.handlers.get('both_held'):
+                if other in self.down:
+                    # Second button of a chord, both presses wait for the release
+                    self.deferred.add(name)
+                    if self.chord_pending.pop(other, None):
+                        self.deferred.add(other)
+                else:
+                    # First button of a possible chord, dispatched once the window passed alone
+                    token = object()
+                    self.chord_pending[name] = (token, now)
+                    threading.Timer(self.chord_window, self._chord_window_passed, args=(name, token)).start()
+            else:
+                self.events.put((name, now))
+
+    def _dispatch_chord_pending(self, name):
+        pending = self.chord_pending.pop(name, None)
+        if pending:
+            self.events.put((name, pending[1]))
+
+    def _chord_window_passed(self, name, token):
+        with self.lock:
+            pending = self.chord_pending.get(name)
+            if pending and pending[0] is token:
+                self._dispatch_chord_pending(name)
+
+    def _on_held(self, name):
+        now = time.monotonic()
+        with self.lock:
+            other = self._other(name)
+            if other in self.down and self.handlers.get('both_held'):
+                if 'both' not in self.fired:
+                    self.fired.update(('both', name, other))
+                    self.events.put(('both_held', now))
+            elif name not in self.fired and self.handlers.get(f"{name}_held"):
+                self.fired.add(name)
+                self.events.put((f"{name}_held", now))
+
+    def _on_released(self, name):
+        now = time.monotonic()
+        with self.lock:
+            if name not in self.down:
+                # Release of a press that was debounced away
+                return
+            self.down.discard(name)
+            if name in self.fired:
+                # The press was a gesture, not a plain press
+                self.fired.discard(name)
+                if not self.fired - {'both'}:
+                    self.fired.discard('both')
+                self.deferred.discard(name)
+                return
+            if name in self.deferred:
+                self.deferred.discard(name)
+                # Timestamped with the press, the wait metric covers what the customer experiences
+                self.events.put((name, self.last_press.get(name, now)))
+
+    def _dispatch_loop(self):
+        while True:
+            gesture, event_time = self.events.get()
+            waited = time.monotonic() - event_time
+            if waited > self.max_event_age:
+                logger.warning(f"Dropped {gesture} event that waited {waited:.1f}s")
+                BUTTON_EVENTS.labels(gesture=gesture, result='dropped').inc()
+                continue
+
+            handler = self.handlers.get(gesture)
+            if handler is None:
+                continue
+            BUTTON_EVENT_WAIT.labels(gesture=gesture).observe(waited)
+            try:
+                handler()
+                BUTTON_EVENTS.labels(gesture=gesture, result='handled').inc()
+            except Exception as e:
+                logger.exception(f"Error handling {gesture}: {e}")
+                BUTTON_EVENTS.labels(gesture=gesture, result='failed').inc()
 
     def wait(self):
         from signal import pause
-        pause()
\ No newline at end of file
+        pause()
@@ -0,0 +1,94 @@
+"""
+Camera Backends
+One object per physical camera, so several cameras can be driven side by side
+"""
+
+import subprocess
+import time
+import logging
+from PIL import Image, ImageDraw
+
+logger = logging.getLogger('CameraBackends')
+logger.setLevel(logging.INFO)
+
+
+class Gphoto2Camera:
+    def __init__(self, port=None):
+        # Without a port gphoto2 picks the first camera it finds, as it always did
+        self.port = port
+        # Name of the capture profile last applied, None until one was applied
+        self.profile = None
+
+    @property
+    def name(self):
+        return self.port or 'default'
+
+    def _command(self, *args):
+        command = ['gphoto2']
+        if self.port:
+            command += ['--port', self.port]
+        return command + list(args)
+
+    def capture(self, photo_path):
+        subprocess.run(self._command('--capture-image-and-download', '--filename', photo_path), check=True)
+        return photo_path
+
+    def get_config(self, keys):
+        """
+        Read several config values in one gphoto2 call.
+
+        Returns:
+            dict: key -> current value as gphoto2 prints it.
+        """
+        args = []
+        for key in keys:
+            args += ['--get-config', key]
+        result = subprocess.run(self._command(*args), capture_output=True, text=True, timeout=15, check=True)
+        # gphoto2 prints one Label/Type/Current/Choice block per key, in the order asked for
+        currents = [line.split(':', 1)[1].strip() for line in result.stdout.splitlines() if line.startswith('Current:')]
+        return dict(zip(keys, currents))
+
+    def set_config(self, settings):
+        """Write several config values in one gphoto2 call, one USB session instead of one per key."""
+        args = []
+        for key, value in settings.items():
+            args += ['--set-config', f"{key}={value}"]
+        subprocess.run(self._command(*args), capture_output=True, text=True, timeout=15, check=True)
+
+
+class FakeCamera:
+    """Stands in for a real camera when testing, writes a generated JPEG after a fixed delay."""
+
+    def __init__(self, port='fake:0', delay=1.0, size=(3000, 2000), fail=False):
+        self.port = port
+        self.delay = delay
+        self.size = size
+        self.fail = fail
+        self.shots = 0
+        self.profile = None
+        self.config = {}
+
+    @property
+    def name(self):
+        return self.port
+
+    def capture(self, photo_path):
+        time.sleep(self.delay)
+        if self.fail:
+            raise subprocess.CalledProcessError(1, ['gphoto2', '--port', self.port, '--capture-image-and-download'])
+        self.shots += 1
+        image = Image.new('RGB', self.size, (40 * self.shots % 256, 120, 200))
+        ImageDraw.Draw(image).text((20, 20), f"{self.port} #{self.shots}", fill=(255, 255, 255))
+        image.save(photo_path, quality=85)
+        return photo_path
+
+    def get_config(self, keys):
+        return {key: self.config[key] for key in keys if key in self.config}
+
+    def set_config(self, settings):
+        self.config.update(settings)
+
+
+def parse_camera_port(auto_detect_line):
+    """Extract the port from a `gphoto2 --auto-detect` line such as 'Canon EOS 2000D  usb:001,005'."""
+    return auto_detect_line.split()[-1]
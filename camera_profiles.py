@@ -0,0 +1,63 @@
+"""
+Camera Profiles
+Named sets of gphoto2 camera settings (image size, quality, format, focus), picked per print layout
+"""
+
+import time
+import logging
+
+logger = logging.getLogger('CameraProfiles')
+logger.setLevel(logging.INFO)
+
+
+class CaptureProfiles:
+    def __init__(self, profiles=None, layout_profiles=None, default_profile=None):
+        """
+        Args:
+            profiles (dict): Profile name -> {gphoto2 config key: value}, for example
+                {"collage": {"imageformat": "Small Fine JPEG", "focusmode": "One Shot"}}. Keys and
+                values are camera specific, `gphoto2 --list-config` shows what a camera offers.
+            layout_profiles (dict): Layout name (print media, with '-strips' when the collage is
+                split into strips) -> profile name.
+            default_profile (str): Profile for layouts without their own, None leaves the camera as is.
+        """
+        self.profiles = profiles or {}
+        self.layout_profiles = layout_profiles or {}
+        self.default_profile = default_profile
+        unknown = {name for name in list(self.layout_profiles.values()) + [default_profile] if name} - set(self.profiles)
+        if unknown:
+            raise ValueError(f"Unknown capture profiles: {', '.join(sorted(unknown))}")
+
+    def profile_for(self, layout):
+        return self.layout_profiles.get(layout, self.default_profile)
+
+    def apply(self, camera, profile_name, force=False):
+        """
+        Bring a camera to a profile, writing only the settings that differ.
+
+        Args:
+            force (bool): Read the camera even if this profile was applied before, for when staff
+                may have turned the dials since.
+
+        Returns:
+            bool: True if the camera has the profile, False if applying it failed.
+        """
+        if profile_name is None:
+            return True
+        if camera.profile == profile_name and not force:
+            return True
+
+        settings = {key: str(value) for key, value in self.profiles[profile_name].items()}
+        start_time = time.time()
+        try:
+            current = camera.get_config(list(settings))
+            changes = {key: value for key, value in settings.items() if current.get(key) != value}
+            if changes:
+                camera.set_config(changes)
+            camera.profile = profile_name
+            logger.info(f"Camera {camera.name} set to profile {profile_name}, changed {sorted(changes) or 'nothing'} in {time.time() - start_time:.2f}s")
+            return True
+        except Exception as e:
+            camera.profile = None
+            logger.error(f"Error applying capture profile {profile_name} to camera {camera.name}: {e}")
+            return False
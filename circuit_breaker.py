@@ -0,0 +1,114 @@
+"""
+Circuit Breaker
+Stops calling a dependency that keeps failing or timing out, so callers fail in milliseconds
+"""
+
+import time
+import threading
+import logging
+from collections import deque
+from prometheus_client import Counter, Gauge
+
+logger = logging.getLogger('CircuitBreaker')
+logger.setLevel(logging.INFO)
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+CIRCUIT_BREAKER_STATE = Gauge(
+    'circuit_breaker_state', 'Circuit breaker state (0 closed, 1 half open, 2 open)', ['breaker'],
+    multiprocess_mode='livemax'
+)
+CIRCUIT_BREAKER_CALLS = Counter('circuit_breaker_calls_total', 'Calls through the circuit breaker by outcome', ['breaker', 'result'])
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, name, probe=None, window=10, min_calls=4, failure_rate=0.5, slow_call_seconds=5.0, open_seconds=30.0):
+        """
+        Args:
+            probe (callable): Cheap call that raises if the dependency is still down. Runs in the
+                background while the breaker is open, a success closes the breaker again.
+            window (int): Number of recent calls the failure rate is computed over.
+            min_calls (int): The breaker only trips once the window holds this many calls.
+            failure_rate (float): Share of failed or slow calls in the window that trips the breaker.
+            slow_call_seconds (float): Calls slower than this count as failures.
+            open_seconds (float): Time between background probes while open.
+        """
+        self.name = name
+        self.probe = probe
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.outcomes = deque(maxlen=window)
+        self.state = CLOSED
+        self.lock = threading.Lock()
+        CIRCUIT_BREAKER_STATE.labels(breaker=name).set(STATE_VALUES[CLOSED])
+
+    def is_open(self):
+        return self.state != CLOSED
+
+    def call(self, function, *args, **kwargs):
+        """Run function through the breaker. Raises CircuitOpenError without calling it while open."""
+        if self.state != CLOSED:
+            CIRCUIT_BREAKER_CALLS.labels(breaker=self.name, result='rejected').inc()
+            raise CircuitOpenError(f"{self.name} circuit is {self.state}")
+
+        start_time = time.time()
+        try:
+            result = function(*args, **kwargs)
+        except Exception:
+            self._record(False)
+            raise
+        self._record(time.time() - start_time <= self.slow_call_seconds)
+        return result
+
+    def _record(self, ok):
+        with self.lock:
+            self.outcomes.append(ok)
+            CIRCUIT_BREAKER_CALLS.labels(breaker=self.name, result='success' if ok else 'failure').inc()
+            failures = self.outcomes.count(False)
+            should_open = (
+                self.state == CLOSED
+                and len(self.outcomes) >= self.min_calls
+                and failures / len(self.outcomes) >= self.failure_rate
+            )
+            if should_open:
+                self._set_state(OPEN)
+        if should_open:
+            logger.error(f"{self.name} circuit opened after {failures} failed or slow calls out of {len(self.outcomes)}")
+            threading.Thread(target=self._probe_loop, name=f"{self.name}-probe", daemon=True).start()
+
+    def _set_state(self, state):
+        self.state = state
+        CIRCUIT_BREAKER_STATE.labels(breaker=self.name).set(STATE_VALUES[state])
+
+    def _probe_loop(self):
+        while True:
+            time.sleep(self.open_seconds)
+            with self.lock:
+                self._set_state(HALF_OPEN)
+            try:
+                start_time = time.time()
+                if self.probe:
+                    self.probe()
+                if time.time() - start_time > self.slow_call_seconds:
+                    raise TimeoutError(f"probe took {time.time() - start_time:.1f}s")
+            except Exception as e:
+                logger.warning(f"{self.name} circuit probe failed, staying open: {e}")
+                with self.lock:
+                    self._set_state(OPEN)
+                continue
+
+            with self.lock:
+                self.outcomes.clear()
+                self._set_state(CLOSED)
+            logger.info(f"{self.name} circuit closed, probe succeeded")
+            return
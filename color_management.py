@@ -0,0 +1,74 @@
+"""
+Color Management
+Converts print rasters from camera sRGB to the printer's ICC profile with cached transforms
+"""
+
+import logging
+import threading
+import time
+from PIL import ImageCms
+
+logger = logging.getLogger('ColorManagement')
+logger.setLevel(logging.INFO)
+
+RENDERING_INTENTS = {
+    'perceptual': ImageCms.Intent.PERCEPTUAL,
+    'relative_colorimetric': ImageCms.Intent.RELATIVE_COLORIMETRIC,
+    'saturation': ImageCms.Intent.SATURATION,
+    'absolute_colorimetric': ImageCms.Intent.ABSOLUTE_COLORIMETRIC,
+}
+
+# Building a transform parses both profiles and precomputes the colour pipeline, which is far
+# too slow to do per print. Transforms are shared by every ColorManager in the process.
+_transform_cache = {}
+_transform_cache_lock = threading.Lock()
+
+
+def _load_profile(profile_path):
+    if profile_path in (None, '', 'sRGB'):
+        return ImageCms.createProfile('sRGB')
+    return ImageCms.getOpenProfile(profile_path)
+
+
+def get_transform(source_profile, destination_profile, rendering_intent='perceptual'):
+    """Return the RGB to RGB transform for the given profiles, building it on first use."""
+    key = (source_profile or 'sRGB', destination_profile, rendering_intent)
+    with _transform_cache_lock:
+        transform = _transform_cache.get(key)
+        if transform is None:
+            start_time = time.time()
+            transform = ImageCms.buildTransform(
+                _load_profile(source_profile),
+                _load_profile(destination_profile),
+                'RGB', 'RGB',
+                renderingIntent=RENDERING_INTENTS[rendering_intent]
+            )
+            _transform_cache[key] = transform
+            logger.info(f"Built ICC transform {key} in {time.time() - start_time:.2f}s")
+        return transform
+
+
+class ColorManager:
+    def __init__(self, printer_profile=None, source_profile='sRGB', rendering_intent='perceptual'):
+        if rendering_intent not in RENDERING_INTENTS:
+            raise ValueError(f"Unknown rendering intent '{rendering_intent}', expected one of {', '.join(RENDERING_INTENTS)}")
+        self.printer_profile = printer_profile
+        self.source_profile = source_profile
+        self.rendering_intent = rendering_intent
+        if self.enabled:
+            # Build the transform at startup so the first print doesn't pay for it
+            get_transform(self.source_profile, self.printer_profile, self.rendering_intent)
+
+    @property
+    def enabled(self):
+        return bool(self.printer_profile)
+
+    def apply(self, image):
+        """Convert the image to the printer profile in place. Does nothing when no profile is configured."""
+        if not self.enabled:
+            return image
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        transform = get_transform(self.source_profile, self.printer_profile, self.rendering_intent)
+        ImageCms.applyTransform(image, transform, inPlace=True)
+        return image
@@ -0,0 +1,291 @@
+"""
+Device Recovery
+Checks camera, printer and sound in the background and works through escalating recovery actions
+when one of them fails, so the booth heals without staff
+"""
+
+import os
+import time
+import fcntl
+import threading
+import logging
+import cups
+from prometheus_client import Counter, Gauge, Histogram
+
+from camera_backends import parse_camera_port
+
+logger = logging.getLogger('DeviceRecovery')
+logger.setLevel(logging.INFO)
+
+DEVICE_HEALTHY = Gauge('device_healthy', 'Whether the device passed its last health check (1) or not (0)', ['device'], multiprocess_mode='livemax')
+# Time from the last good check to the failed one, the upper bound of how long the failure went unnoticed
+DEVICE_DETECT_SECONDS = Histogram(
+    'device_time_to_detect_seconds', 'Time from the last healthy check until a failure was detected', ['device'],
+    buckets=(1, 5, 10, 15, 30, 45, 60, 120, 300, 600)
+)
+DEVICE_RECOVER_SECONDS = Histogram(
+    'device_time_to_recover_seconds', 'Time from detecting a failure until the device was healthy again', ['device'],
+    buckets=(5, 10, 20, 30, 60, 120, 300, 600, 1800, 3600)
+)
+RECOVERY_ACTIONS = Counter('device_recovery_actions_total', 'Recovery actions per device, action and outcome', ['device', 'action', 'result'])
+
+USB_DEVICES = '/sys/bus/usb/devices'
+USB_DRIVER = '/sys/bus/usb/drivers/usb'
+# _IO('U', 20) from linux/usbdevice_fs.h
+USBDEVFS_RESET = ord('U') << 8 | 20
+
+# IPP printer-state stopped
+PRINTER_STOPPED = 5
+
+DEVICES = ('camera', 'printer', 'sound')
+
+# Longest wait between repeats of the last action once a device's recovery ran out of steps
+MAX_RETRY_SECONDS = 3600
+
+
+def usb_sysfs_name(bus, device):
+    """Find the sysfs name (such as '1-1.2') of the USB device at bus/device number, or None."""
+    for name in os.listdir(USB_DEVICES):
+        try:
+            with open(os.path.join(USB_DEVICES, name, 'busnum')) as file:
+                if int(file.read()) != bus:
+                    continue
+            with open(os.path.join(USB_DEVICES, name, 'devnum')) as file:
+                if int(file.read()) == device:
+                    return name
+        except (OSError, ValueError):
+            continue
+    return None
+
+
+def usb_address(sysfs_name):
+    """Current (bus, device) numbers of a sysfs USB device, they change when it re-enumerates."""
+    with open(os.path.join(USB_DEVICES, sysfs_name, 'busnum')) as file:
+        bus = int(file.read())
+    with open(os.path.join(USB_DEVICES, sysfs_name, 'devnum')) as file:
+        device = int(file.read())
+    return bus, device
+
+
+def parse_usb_port(port):
+    """(bus, device) from a gphoto2 port such as 'usb:001,005', or None for other ports."""
+    if not port or not port.startswith('usb:') or ',' not in port:
+        return None
+    bus, device = port[4:].split(',')
+    return int(bus), int(device)
+
+
+class DeviceRecovery:
+    def __init__(self, photo_service, printer_service, sound_service, is_busy=None, interval=30, settle_seconds=5):
+        """
+        Args:
+            is_busy (callable): Returns True while a session runs, checks and actions wait until it is False.
+            interval (float): Seconds between health checks while everything is healthy.
+            settle_seconds (float): Seconds between a recovery action and the next check.
+        """
+        self.photo_service = photo_service
+        self.printer_service = printer_service
+        self.sound_service = sound_service
+        self.is_busy = is_busy or (lambda: False)
+        self.interval = interval
+        self.settle_seconds = settle_seconds
+        self.conn = None
+        self.unhealthy_printers = []
+        self.wake = threading.Event()
+        # sysfs names of the cameras seen while healthy, they survive a re-enumeration
+        self.camera_usb_names = {}
+        now = time.time()
+        self.health = {device: {'last_healthy': now, 'failed_at': None, 'step': 0, 'retry_at': 0} for device in DEVICES}
+
+        self.checks = {
+            'camera': self._camera_healthy,
+            'printer': self._printer_healthy,
+            'sound': self.sound_service.is_healthy,
+        }
+        # Cheapest first, each failed check after an action moves one step further
+        self.actions = {
+            'camera': [('usb_reset', self._reset_camera_usb), ('usb_rebind', self._rebind_camera_usb)],
+            'printer': [('enable_queue', self._enable_printers), ('cancel_stuck_jobs', self._cancel_stuck_jobs)],
+            'sound': [('restart_mixer', self.sound_service.restart)],
+        }
+
+    def start(self):
+        threading.Thread(target=self._loop, name='device-recovery', daemon=True).start()
+
+    def report_failure(self, device):
+        """Called when a session ran into a failing device, checks it right away."""
+        logger.warning(f"{device} failure reported, checking it now")
+        self.wake.set()
+
+    def _loop(self):
+        while True:
+            if not self.is_busy():
+                for device in DEVICES:
+                    try:
+                        if device == 'camera':
+                            # Keep gphoto2 calls apart from a capture or keep-alive of a starting session
+                            with self.photo_service.camera_lock:
+                                self._check(device)
+                        else:
+                            self._check(device)
+                    except Exception as e:
+                        logger.error(f"Error checking {device}: {e}")
+            # Check back soon only while there are recovery steps left to try
+            escalating = any(
+                health['failed_at'] is not None and health['step'] < len(self.actions[device])
+                for device, health in self.health.items()
+            )
+            self.wake.wait(self.settle_seconds if escalating else self.interval)
+            self.wake.clear()
+
+    def _check(self, device):
+        now = time.time()
+        health = self.health[device]
+        if self.checks[device]():
+            if health['failed_at'] is not None:
+                DEVICE_RECOVER_SECONDS.labels(device=device).observe(now - health['failed_at'])
+                logger.info(f"{device} recovered after {now - health['failed_at']:.0f}s")
+            health.update(last_healthy=now, failed_at=None, step=0, retry_at=0)
+            DEVICE_HEALTHY.labels(device=device).set(1)
+            return True
+
+        DEVICE_HEALTHY.labels(device=device).set(0)
+        if health['failed_at'] is None:
+            health['failed_at'] = now
+            DEVICE_DETECT_SECONDS.labels(device=device).observe(now - health['last_healthy'])
+            logger.error(f"{device} failed its health check, starting recovery")
+
+        # The check can take a while, a session may have started meanwhile and must not get its
+        # camera reset or its print cancelled
+        if self.is_busy():
+            logger.info(f"Session started, postponing recovery of {device}")
+            return False
+
+        actions = self.actions[device]
+        if health['step'] >= len(actions) and now < health['retry_at']:
+            return False
+        name, action = actions[min(health['step'], len(actions) - 1)]
+        health['step'] += 1
+        try:
+            action()
+            RECOVERY_ACTIONS.labels(device=device, action=name, result='done').inc()
+            logger.info(f"Recovery action {name} on {device} done")
+        except Exception as e:
+            RECOVERY_ACTIONS.labels(device=device, action=name, result='failed').inc()
+            logger.error(f"Recovery action {name} on {device} failed: {e}")
+
+        if health['step'] >= len(actions):
+            # Out of steps, repeat the last one with a growing pause instead of every few seconds
+            retry_seconds = min(self.interval * 2 ** (health['step'] - len(actions)), MAX_RETRY_SECONDS)
+            health['retry_at'] = now + retry_seconds
+            if health['step'] == len(actions):
+                logger.error(f"Critical error: {device}_recovery_exhausted")
+            logger.warning(f"{device} still failing, repeating {name} in {retry_seconds:.0f}s")
+        return False
+
+    def _camera_healthy(self):
+        if self.photo_service.camera_backend == 'fake':
+            return True
+        detected, camera_lines = self.photo_service.detect_connected_cameras(report=False)
+        if not detected or not camera_lines:
+            return False
+        # Remember where the cameras are plugged in, the recovery needs it once they are gone
+        for line in camera_lines:
+            port = parse_camera_port(line)
+            address = parse_usb_port(port)
+            if address:
+                name = usb_sysfs_name(*address)
+                if name:
+                    self.camera_usb_names[port] = name
+        return True
+
+    def _reset_camera_usb(self):
+        """USBDEVFS_RESET on every known camera, like unplugging and replugging it."""
+        if not self.camera_usb_names:
+            raise RuntimeError("no camera USB address known yet")
+        for name in set(self.camera_usb_names.values()):
+            bus, device = usb_address(name)
+            fd = os.open(f"/dev/bus/usb/{bus:03d}/{device:03d}", os.O_WRONLY)
+            try:
+                fcntl.ioctl(fd, USBDEVFS_RESET, 0)
+            finally:
+                os.close(fd)
+        self._update_camera_ports()
+
+    def _rebind_camera_usb(self):
+        """Unbind and bind the cameras' USB devices, for when a reset is not enough."""
+        if not self.camera_usb_names:
+            raise RuntimeError("no camera USB address known yet")
+        for name in set(self.camera_usb_names.values()):
+            with open(os.path.join(USB_DRIVER, 'unbind'), 'w') as file:
+                file.write(name)
+            time.sleep(1)
+            with open(os.path.join(USB_DRIVER, 'bind'), 'w') as file:
+                file.write(name)
+        time.sleep(2)
+        self._update_camera_ports()
+
+    def _update_camera_ports(self):
+        """Point cameras with a fixed port at their new device number after re-enumeration."""
+        for old_port, name in list(self.camera_usb_names.items()):
+            try:
+                bus, device = usb_address(name)
+            except OSError:
+                continue
+            new_port = f"usb:{bus:03d},{device:03d}"
+            if new_port == old_port:
+                continue
+            for camera in self.photo_service.cameras:
+                if camera.port == old_port:
+                    camera.port = new_port
+                    camera.profile = None
+            del self.camera_usb_names[old_port]
+            self.camera_usb_names[new_port] = name
+            logger.info(f"Camera moved from {old_port} to {new_port}")
+
+    def _connection(self):
+        # pycups connections are not thread safe, recovery gets its own
+        if self.conn is None:
+            self.conn = cups.Connection()
+        return self.conn
+
+    def _printer_healthy(self):
+        """
+        Every queue is running and accepting jobs, the ones that are not are kept for the actions.
+        Empty media is not something to recover from.
+        """
+        try:
+            conn = self._connection()
+            unhealthy = []
+            for name in self.printer_service.printer_names:
+                attributes = conn.getPrinterAttributes(name, requested_attributes=['printer-state', 'printer-is-accepting-jobs'])
+                if attributes.get('printer-state') == PRINTER_STOPPED or not attributes.get('printer-is-accepting-jobs', True):
+                    logger.error(f"Printer {name} is stopped or not accepting jobs")
+                    unhealthy.append(name)
+            self.unhealthy_printers = unhealthy
+            return not unhealthy
+        except Exception as e:
+            self.conn = None
+            logger.error(f"Error reading printer state: {e}")
+            return False
+
+    def _enable_printers(self):
+        conn = self._connection()
+        for name in self.unhealthy_printers:
+            conn.enablePrinter(name)
+            conn.acceptJobs(name)
+            self.printer_service.printer_pool.clear_failure(name)
+
+    def _cancel_stuck_jobs(self):
+        """
+        Cancel the job each stopped printer is stuck on, then start the queues again. Jobs still
+        waiting behind it, from hf2pp or other sessions, stay queued.
+        """
+        conn = self._connection()
+        jobs = conn.getJobs(which_jobs='not-completed', requested_attributes=['job-printer-uri', 'job-state'])
+        for job_id, job in jobs.items():
+            printer = job.get('job-printer-uri', '').rsplit('/', 1)[-1]
+            if printer in self.unhealthy_printers and job.get('job-state') in (cups.IPP_JOB_PROCESSING, cups.IPP_JOB_STOPPED):
+                conn.cancelJob(job_id)
+                logger.info(f"Cancelled stuck job {job_id} on printer {printer}")
+        self._enable_printers()
@@ -0,0 +1,165 @@
+"""
+Fake SumUp Server
+Local stand-in for the SumUp API with injectable faults, for trying the payment path without a terminal
+
+Set "paymentApi": {"baseUrl": "http://127.0.0.1:8090"} in config.json and run
+    python fake_sumup_server.py --error-rate 0.5 --latency 2
+Faults can be changed while it runs:
+    curl -X POST localhost:8090/_faults -d '{"error_rate": 1.0}'
+Checkouts with a return_url get the result posted there like the real reader webhook, unless
+drop_webhooks is set, which leaves the booth to its fallback polling.
+"""
+
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+import logging
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+logger = logging.getLogger('FakeSumUp')
+logger.setLevel(logging.INFO)
+
+faults = {
+    'error_rate': 0.0,   # share of requests answered with error_status
+    'error_status': 503,
+    'latency': 0.0,      # seconds added to every request
+    'hang_rate': 0.0,    # share of requests that sleep hang_seconds, past the client timeout
+    'hang_seconds': 30.0,
+    'pay_after': 5.0,    # seconds after checkout until the transaction turns SUCCESSFUL
+    'decline': False,    # transactions end FAILED instead
+    'drop_webhooks': False,
+}
+transactions = {}
+lock = threading.Lock()
+
+
+class FakeSumUpHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        logger.info(format % args)
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _inject_faults(self):
+        """Apply the configured latency and failures, returns True if the request was answered."""
+        if faults['latency']:
+            time.sleep(faults['latency'])
+        if random.random() < faults['hang_rate']:
+            time.sleep(faults['hang_seconds'])
+        if random.random() < faults['error_rate']:
+            self._send_json(faults['error_status'], {'message': 'injected fault'})
+            return True
+        return False
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        if path == '/_faults':
+            with lock:
+                faults.update(self._read_body())
+            self._send_json(200, faults)
+            return
+        if self._inject_faults():
+            return
+
+        if path.startswith('/v0.1/merchants/') and path.endswith('/checkout'):
+            body = self._read_body()
+            client_transaction_id = str(uuid.uuid4())
+            with lock:
+                transactions[client_transaction_id] = {
+                    'created': time.time(),
+                    'amount': body.get('total_amount', {}),
+                    'transaction_code': 'FAKE' + client_transaction_id[:6].upper(),
+                }
+            self._send_json(201, {'data': {'client_transaction_id': client_transaction_id}})
+            if body.get('return_url') and not faults['drop_webhooks']:
+                threading.Timer(faults['pay_after'], send_webhook, args=(body['return_url'], client_transaction_id)).start()
+        else:
+            self._send_json(404, {'message': 'not found'})
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        if parsed.path == '/_faults':
+            self._send_json(200, faults)
+            return
+        if self._inject_faults():
+            return
+
+        parts = parsed.path.strip('/').split('/')
+        if parsed.path.startswith('/v2.1/merchants/') and parts[-1] == 'transactions':
+            client_transaction_id = parse_qs(parsed.query).get('client_transaction_id', [''])[0]
+            with lock:
+                transaction = transactions.get(client_transaction_id)
+            if transaction is None:
+                self._send_json(404, {'message': 'transaction not found'})
+                return
+            if time.time() - transaction['created'] < faults['pay_after']:
+                status = 'PENDING'
+            else:
+                status = 'FAILED' if faults['decline'] else 'SUCCESSFUL'
+            self._send_json(200, {'items': [{
+                'client_transaction_id': client_transaction_id,
+                'transaction_code': transaction['transaction_code'],
+                'status': status,
+            }]})
+        elif parsed.path.startswith('/v0.1/merchants/') and len(parts) == 5 and parts[3] == 'readers':
+            self._send_json(200, {'id': parts[4], 'status': 'paired'})
+        else:
+            self._send_json(404, {'message': 'not found'})
+
+
+def send_webhook(return_url, client_transaction_id):
+    """Post the final status the way SumUp reports a reader checkout."""
+    status = 'failed' if faults['decline'] else 'successful'
+    body = json.dumps({
+        'id': str(uuid.uuid4()),
+        'event_type': 'solo.transaction.updated',
+        'payload': {'client_transaction_id': client_transaction_id, 'status': status},
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    }).encode()
+    request = urllib.request.Request(return_url, data=body, headers={'Content-Type': 'application/json'}, method='POST')
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            logger.info(f"Webhook for {client_transaction_id} answered {response.status}")
+    except Exception as e:
+        logger.error(f"Webhook for {client_transaction_id} failed: {e}")
+
+
+def serve(port=8090, host='127.0.0.1'):
+    server = ThreadingHTTPServer((host, port), FakeSumUpHandler)
+    server.daemon_threads = True
+    logger.info(f"Fake SumUp API listening on http://{host}:{port}")
+    return server
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    parser = argparse.ArgumentParser(description='Fake SumUp API with injectable faults')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-status', type=int, default=503)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--hang-rate', type=float, default=0.0)
+    parser.add_argument('--pay-after', type=float, default=5.0)
+    parser.add_argument('--decline', action='store_true')
+    parser.add_argument('--drop-webhooks', action='store_true')
+    args = parser.parse_args()
+    faults.update(
+        error_rate=args.error_rate, error_status=args.error_status, latency=args.latency,
+        hang_rate=args.hang_rate, pay_after=args.pay_after, decline=args.decline,
+        drop_webhooks=args.drop_webhooks
+    )
+    serve(args.port).serve_forever()
@@ -0,0 +1,311 @@
+"""
+Gallery Service
+Read-only HTTP gallery of the archived collages, with thumbnails and previews generated at archive time
+"""
+
+import os
+import json
+import html
+import queue
+import threading
+import logging
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from PIL import Image
+
+logger = logging.getLogger('GalleryService')
+logger.setLevel(logging.INFO)
+
+RENDITIONS = {
+    'thumbs': (240, 360),
+    'previews': (800, 1200),
+}
+
+
+class ArchiveGallery:
+    def __init__(self, archive_directory='archive', cache_directory='gallery_cache', max_cache_mb=200, page_size=48):
+        self.archive_directory = archive_directory
+        self.cache_directory = cache_directory
+        self.max_cache_bytes = max_cache_mb * 1024 * 1024
+        self.page_size = page_size
+        self.index_path = os.path.join(cache_directory, 'index.json')
+        self.lock = threading.Lock()
+        # Serialises writing and evicting renditions, the worker and request threads both do it
+        self.cache_lock = threading.Lock()
+        self.work_queue = queue.Queue()
+        self.server = None
+
+        for rendition in RENDITIONS:
+            os.makedirs(os.path.join(cache_directory, rendition), exist_ok=True)
+        self.entries = self._load_index()
+
+        # Renditions are generated on a background worker so archiving never waits for them
+        threading.Thread(target=self._worker, daemon=True).start()
+        self._index_missing_archive_files()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return []
+        except Exception as e:
+            logger.error(f"Error reading gallery index, rebuilding it: {e}")
+            return []
+
+    def _save_index(self):
+        temp_path = self.index_path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(self.entries, file)
+        os.replace(temp_path, self.index_path)
+
+    def _index_missing_archive_files(self):
+        if not os.path.isdir(self.archive_directory):
+            return
+        archived = set(os.listdir(self.archive_directory))
+        with self.lock:
+            removed = [entry['name'] for entry in self.entries if entry['name'] not in archived]
+            if removed:
+                self.entries = [entry for entry in self.entries if entry['name'] in archived]
+                self._save_index()
+            indexed = {entry['name'] for entry in self.entries}
+        if removed:
+            with self.cache_lock:
+                for name in removed:
+                    for rendition in RENDITIONS:
+                        path = os.path.join(self.cache_directory, rendition, name)
+                        if os.path.exists(path):
+                            os.remove(path)
+            logger.info(f"Removed {len(removed)} deleted archive files from the gallery")
+        for name in sorted(archived):
+            if name not in indexed and name.lower().endswith(('.jpg', '.jpeg')):
+                self.add(os.path.join(self.archive_directory, name))
+
+    def add(self, archive_path):
+        """Queue an archived collage for thumbnail and preview generation."""
+        self.work_queue.put(archive_path)
+
+    def _worker(self):
+        while True:
+            archive_path = self.work_queue.get()
+            try:
+                self._generate_renditions(archive_path)
+            except Exception as e:
+                logger.error(f"Error generating gallery renditions for {archive_path}: {e}")
+
+    def _generate_renditions(self, archive_path):
+        name = os.path.basename(archive_path)
+        with Image.open(archive_path) as image, self.cache_lock:
+            width, height = image.size
+            self._render(image, name, *RENDITIONS)
+
+        stat = os.stat(archive_path)
+        with self.lock:
+            self.entries = [entry for entry in self.entries if entry['name'] != name]
+            self.entries.append({'name': name, 'size': stat.st_size, 'mtime': stat.st_mtime, 'width': width, 'height': height})
+            self.entries.sort(key=lambda entry: entry['mtime'], reverse=True)
+            self._save_index()
+        self._evict()
+        logger.info(f"Gallery renditions created for {name}")
+
+    def _render(self, image, name, *renditions):
+        """Write the given renditions of an opened image, largest first so each one is scaled from the previous."""
+        renditions = sorted(renditions, key=lambda rendition: RENDITIONS[rendition], reverse=True)
+        # Let the JPEG decoder downscale by a power of two, much cheaper than decoding the full image
+        image.draft('RGB', RENDITIONS[renditions[0]])
+        scaled = image.convert('RGB')
+        for rendition in renditions:
+            scaled.thumbnail(RENDITIONS[rendition], Image.BILINEAR)
+            path = os.path.join(self.cache_directory, rendition, name)
+            # Readers only ever see a complete file
+            temp_path = path + '.tmp'
+            scaled.save(temp_path, format='JPEG', quality=80, optimize=True)
+            os.replace(temp_path, path)
+
+    def _evict(self):
+        """Delete the oldest renditions until the cache fits its size limit."""
+        with self.cache_lock:
+            files = []
+            for rendition in RENDITIONS:
+                directory = os.path.join(self.cache_directory, rendition)
+                for name in os.listdir(directory):
+                    path = os.path.join(directory, name)
+                    stat = os.stat(path)
+                    files.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_cache_bytes:
+                    break
+                os.remove(path)
+                total -= size
+
+    def page(self, number):
+        with self.lock:
+            start = (number - 1) * self.page_size
+            entries = self.entries[start:start + self.page_size]
+            total = len(self.entries)
+        return {
+            'page': number,
+            'pages': max(1, (total + self.page_size - 1) // self.page_size),
+            'total': total,
+            'photos': entries,
+        }
+
+    def file_path(self, rendition, name):
+        """Resolve a request to a file on disk, regenerating evicted renditions. Returns None if unknown."""
+        name = os.path.basename(name)
+        archive_path = os.path.join(self.archive_directory, name)
+        if not os.path.isfile(archive_path):
+            return None
+        if rendition == 'photos':
+            return archive_path
+        if rendition not in RENDITIONS:
+            return None
+        cache_path = os.path.join(self.cache_directory, rendition, name)
+        with self.cache_lock:
+            if not os.path.isfile(cache_path):
+                with Image.open(archive_path) as image:
+                    self._render(image, name, rendition)
+        return cache_path
+
+    def start(self, port=8001):
+        handler = type('Handler', (GalleryRequestHandler,), {'gallery': self})
+        self.server = ThreadingHTTPServer(('', port), handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        logger.info(f"Gallery served on port {port}")
+
+
+class GalleryRequestHandler(BaseHTTPRequestHandler):
+    gallery = None
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        try:
+            page_number = max(1, int(query.get('page', ['1'])[0]))
+        except ValueError:
+            page_number = 1
+
+        if url.path == '/':
+            self._send_html(self.gallery.page(page_number))
+        elif url.path == '/api/photos':
+            self._send_body(200, 'application/json', json.dumps(self.gallery.page(page_number)).encode())
+        else:
+            parts = url.path.strip('/').split('/')
+            path = self.gallery.file_path(parts[0], parts[1]) if len(parts) == 2 else None
+            if path is None:
+                self._send_body(404, 'text/plain', b'Not found')
+            else:
+                try:
+                    with open(path, 'rb') as file:
+                        self._send_file(file)
+                except FileNotFoundError:
+                    # Evicted between resolving and opening it
+                    self._send_body(404, 'text/plain', b'Not found')
+
+    def _send_body(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_html(self, page):
+        items = ''.join(
+            f'<a href="/previews/{html.escape(entry["name"])}"><img src="/thumbs/{html.escape(entry["name"])}" '
+            f'title="{html.escape(entry["name"])}" loading="lazy"></a>'
+            for entry in page['photos']
+        )
+        navigation = ''
+        if page['page'] > 1:
+            navigation += f'<a href="/?page={page["page"] - 1}">newer</a> '
+        if page['page'] < page['pages']:
+            navigation += f'<a href="/?page={page["page"] + 1}">older</a>'
+        body = (
+            '<!doctype html><html><head><title>Photobooth archive</title>'
+            '<style>img{margin:4px;height:180px}</style></head><body>'
+            f'<p>{page["total"]} collages, page {page["page"]} of {page["pages"]}</p>{items}<p>{navigation}</p>'
+            '</body></html>'
+        )
+        self._send_body(200, 'text/html; charset=utf-8', body.encode())
+
+    def _send_file(self, file):
+        # The open file stays readable even if the cache evicts it meanwhile
+        stat = os.fstat(file.fileno())
+        etag = f'"{int(stat.st_mtime)}-{stat.st_size}"'
+        last_modified = formatdate(stat.st_mtime, usegmt=True)
+
+        if self._not_modified(etag, stat.st_mtime):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        start, end = 0, stat.st_size - 1
+        status = 200
+        range_header = self.headers.get('Range')
+        if range_header and self.headers.get('If-Range', etag) == etag:
+            byte_range = self._parse_range(range_header, stat.st_size)
+            if byte_range is None:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{stat.st_size}')
+                self.end_headers()
+                return
+            start, end = byte_range
+            status = 206
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', last_modified)
+        self.send_header('Cache-Control', 'public, max-age=86400')
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{stat.st_size}')
+        self.end_headers()
+
+        file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = file.read(min(64 * 1024, remaining))
+            if not chunk:
+                break
+            self.wfile.write(chunk)
+            remaining -= len(chunk)
+
+    def _not_modified(self, etag, mtime):
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            return etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since:
+            try:
+                return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def _parse_range(self, range_header, size):
+        """Parse a single 'bytes=start-end' range. Returns (start, end) or None if not satisfiable."""
+        if not range_header.startswith('bytes=') or ',' in range_header:
+            return None
+        start_text, _, end_text = range_header[len('bytes='):].partition('-')
+        try:
+            if start_text == '':
+                length = int(end_text)
+                if length <= 0:
+                    return None
+                return max(0, size - length), size - 1
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+        except ValueError:
+            return None
+        if start >= size or end < start:
+            return None
+        return start, min(end, size - 1)
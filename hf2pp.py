@@ -1,64 +1,182 @@
 import os
 import time
 import shutil
-from PIL import Image
 import cups
 import tempfile
+from PIL import Image
+from prometheus_client import Counter, Gauge, Histogram
+
+from print_imposition import PrintImposer
+from color_management import ColorManager
+from printer_pool import PrinterPool
+import metrics
+
+HOTFOLDER_FILES = Counter('hotfolder_files_total', 'Images picked up from the hot folder', ['result'])
+HOTFOLDER_SHEETS = Counter('hotfolder_sheets_total', 'Sheets printed from the hot folder', ['result'])
+HOTFOLDER_PENDING = Gauge('hotfolder_pending_images', 'Images waiting for a sheet', multiprocess_mode='livemax')
+HOTFOLDER_SHEET_SECONDS = Histogram('hotfolder_sheet_seconds', 'Time to render and submit one sheet')
 
 # Directory to monitor
 directory = "/home/viktoras/photobooth/photos"
 temp_directory = tempfile.mkdtemp()  # Create a temporary directory
+# Images that cannot be decoded are moved here instead of holding up the others
+failed_directory = os.path.join(directory, "failed")
+
+# Set your CUPS printer names here, each sheet goes to the least busy printer with media left
+printer_names = ["Dai_Nippon_Printing_DS-RX1"]
+
+# Media loaded in the printer, see print_imposition.MEDIA
+media = "4x6"
+
+# ICC profile of the printer and media, leave empty to send camera sRGB as-is
+icc_profile = ""
+rendering_intent = "perceptual"
+
+# Metrics export, see metrics.py. In multiprocess mode the controller serves these metrics,
+# set "textfile" to have node_exporter pick them up from the directory, None exports nothing
+metrics_mode = "multiprocess" if os.environ.get(metrics.MULTIPROC_DIR_VARIABLE) else None
+metrics_textfile_directory = "/var/lib/node_exporter/textfile_collector"
+
+# How long a half-filled sheet may wait for more images before it is printed anyway
+max_hold_seconds = 30
+
+# Scans a sheet may fail to render before its unreadable images are quarantined
+max_render_attempts = 3
+
 
-# Set your CUPS printer name here
-printer_name = "Dai_Nippon_Printing_DS-RX1"
+def is_readable(file_path):
+    """Decode the image at reduced size, enough to find truncated or corrupt files cheaply."""
+    try:
+        with Image.open(file_path) as image:
+            image.draft('RGB', (256, 256))
+            image.load()
+        return True
+    except Exception as e:
+        print(f"Image {os.path.basename(file_path)} is not readable: {e}")
+        return False
+
+
+def quarantine(file_path):
+    """Move an image that cannot be printed to the failed directory."""
+    try:
+        os.makedirs(failed_directory, exist_ok=True)
+        shutil.move(file_path, os.path.join(failed_directory, os.path.basename(file_path)))
+        print(f"Moved {os.path.basename(file_path)} to {failed_directory}")
+    except Exception as e:
+        print(f"Error moving {file_path} to {failed_directory}: {e}")
+    HOTFOLDER_FILES.labels(result='failed').inc()
 
 def watch_directory(directory):
     conn = cups.Connection()
-    
+    printer_pool = PrinterPool(conn, printer_names)
+    imposer = PrintImposer(media=media)
+    color_manager = ColorManager(printer_profile=icc_profile, rendering_intent=rendering_intent)
+    pending = {}  # file path -> time it was picked up
+    rendered = {}  # images of a sheet -> its rendered file, reused when printing it is retried
+    render_failures = {}  # images of a sheet -> scans it failed to render in
+
     while True:
-        for filename in os.listdir(directory):
+        for filename in sorted(os.listdir(directory)):
             if filename.lower().endswith(".jpg") or filename.lower().endswith(".jpeg"):
                 file_path = os.path.join(directory, filename)
                 try:
                     # Move the file to the temporary directory
                     shutil.move(file_path, temp_directory)
-                    temp_file_path = os.path.join(temp_directory, filename)
-
-                    # Open the file using Pillow (PIL)
-                    image = Image.open(temp_file_path)
-
-                    # Check if width (x) is greater than height (y)
-                    x, y = image.size
-                    if x < y:
-                        # Rotate the image to landscape (90 degrees clockwise)
-                        rotated_image = image.rotate(-90, expand=True)
-                        print(f"Image rotated!")
-                    else:
-                        rotated_image = image  # No rotation needed
-                        print(f"Image NOT rotated!")
-
-                    # Resize while maintaining aspect ratio
-                    new_width, new_height = 1800, 1200
-                    rotated_image.thumbnail((new_width, new_height), Image.LANCZOS)
-
-                    # Create a new white canvas
-                    canvas = Image.new("RGB", (new_width, new_height), "white")
-                    offset = ((new_width - rotated_image.width) // 2, (new_height - rotated_image.height) // 2)
-                    canvas.paste(rotated_image, offset)
-
-                    # Save the modified image
-                    canvas.save(temp_file_path)
-
-                    # Print the file
-                    job_id = conn.printFile(printer_name, temp_file_path, "My Print Job", {})
-                    print(f"File {filename} printed (Job ID: {job_id})")
-
-                    # Delete the temporary file
-                    os.remove(temp_file_path)
-                    print(f"Temporary file {temp_file_path} deleted.")
+                    temp_path = os.path.join(temp_directory, filename)
+                    if not is_readable(temp_path):
+                        quarantine(temp_path)
+                        continue
+                    pending[temp_path] = time.time()
+                    HOTFOLDER_FILES.labels(result='picked_up').inc()
                 except Exception as e:
                     print(f"Error processing {filename}: {e}")
+                    HOTFOLDER_FILES.labels(result='failed').inc()
+
+        if pending:
+            try:
+                sheets = imposer.plan(list(pending))
+            except Exception as e:
+                # Only the images that cannot be read are taken out, the rest are planned next scan
+                print(f"Error planning sheets: {e}")
+                for file_path in [path for path in pending if not is_readable(path)]:
+                    quarantine(file_path)
+                    pending.pop(file_path)
+                sheets = []
+
+            hold_expired = bool(pending) and time.time() - min(pending.values()) >= max_hold_seconds
+            for sheet in sheets:
+                sheet_key = tuple(sheet.images)
+                if not sheet.is_full() and not hold_expired:
+                    # Wait for the next scan, another image may fill the sheet
+                    continue
+                available_printers = printer_pool.available_printers()
+                if not available_printers:
+                    print("No printer available, waiting for the next scan")
+                    break
+
+                sheet_start_time = time.time()
+                sheet_file_path = rendered.get(sheet_key)
+                if sheet_file_path is None:
+                    file_descriptor, sheet_file_path = tempfile.mkstemp(prefix="sheet_", suffix=".jpg", dir=temp_directory)
+                    os.close(file_descriptor)
+                    try:
+                        color_manager.apply(imposer.render(sheet)).save(sheet_file_path)
+                        rendered[sheet_key] = sheet_file_path
+                        render_failures.pop(sheet_key, None)
+                    except Exception as e:
+                        HOTFOLDER_SHEETS.labels(result='failed').inc()
+                        os.remove(sheet_file_path)
+                        render_failures[sheet_key] = render_failures.get(sheet_key, 0) + 1
+                        if render_failures[sheet_key] < max_render_attempts:
+                            print(f"Error rendering sheet, keeping its images for the next scan: {e}")
+                            continue
+                        # Take out the images that cannot be read, the others get a new sheet next
+                        # scan. If none of them fails on its own, none of them can be printed.
+                        print(f"Error rendering sheet {render_failures.pop(sheet_key)} times, quarantining its unreadable images: {e}")
+                        bad_images = [path for path in sheet.images if not is_readable(path)] or sheet.images
+                        for file_path in bad_images:
+                            quarantine(file_path)
+                            pending.pop(file_path, None)
+                        continue
+
+                # Print the sheet with the page size that cuts it into the right pieces,
+                # falling over to the next printer if the submission fails
+                printed = False
+                for printer_name in available_printers:
+                    try:
+                        job_id = conn.printFile(printer_name, sheet_file_path, "My Print Job", sheet.options)
+                        printer_pool.report_success(printer_name)
+                        print(f"Sheet with {len(sheet.images)} images printed on {printer_name} as {sheet.options['PageSize']} (Job ID: {job_id})")
+                        printed = True
+                        break
+                    except Exception as e:
+                        print(f"Error printing sheet on {printer_name}: {e}")
+                        printer_pool.report_failure(printer_name)
+
+                HOTFOLDER_SHEETS.labels(result='printed' if printed else 'failed').inc()
+                HOTFOLDER_SHEET_SECONDS.observe(time.time() - sheet_start_time)
+                if not printed:
+                    # Every printer failed, the next sheets would fail the same way
+                    print(f"Sheet with {len(sheet.images)} images not printed, keeping them for the next scan")
+                    break
+
+                # Delete the temporary files, only now that the sheet is printed
+                for file_path in sheet.images + [rendered.pop(sheet_key)]:
+                    if os.path.exists(file_path):
+                        os.remove(file_path)
+                    pending.pop(file_path, None)
+                print(f"Temporary files for {len(sheet.images)} images deleted.")
+
+            # New images changed the plan, sheets rendered for the old one are not needed anymore
+            planned = {tuple(sheet.images) for sheet in sheets}
+            for sheet_key in [key for key in rendered if key not in planned]:
+                os.remove(rendered.pop(sheet_key))
+            for sheet_key in [key for key in render_failures if key not in planned]:
+                del render_failures[sheet_key]
+        HOTFOLDER_PENDING.set(len(pending))
         time.sleep(5)  # Wait for 5 seconds before checking the directory again
 
 if __name__ == "__main__":
+    if metrics_mode:
+        metrics.start_metrics_export('hf2pp', mode=metrics_mode, textfile_directory=metrics_textfile_directory, serve=False)
     watch_directory(directory)
@@ -94,6 +94,28 @@ class LEDManager:
             time.sleep(0.4)
         logger.debug(f"Both buttons flashed green {times} times.")
 
+    def flash_button1_green(self, times):
+        """Blink only button 1, button 2 stays as it is."""
+        for _ in range(times):
+            self.set_button1_color(0, 1, 0)
+            time.sleep(0.4)
+            self.set_button1_color(0, 0, 0)
+            time.sleep(0.4)
+        logger.debug(f"Button 1 flashed green {times} times.")
+
+    def flash_button_amber(self, times):
+        """Short double blinks in amber, shown when the payment terminal is known to be unreachable."""
+        for _ in range(times):
+            for _ in range(2):
+                self.set_button1_color(1, 0.4, 0)
+                self.set_button2_color(1, 0.4, 0)
+                time.sleep(0.1)
+                self.set_button1_color(0, 0, 0)
+                self.set_button2_color(0, 0, 0)
+                time.sleep(0.1)
+            time.sleep(0.4)
+        logger.debug(f"Both buttons flashed amber {times} times.")
+
     def start_pulsing_button1(self):
         """Start pulsing LEDs for Button 1 only."""
         if not self.pulsing_active_button1:
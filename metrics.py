@@ -0,0 +1,108 @@
+"""
+Metrics
+One metrics surface for every booth process (controller, hf2pp)
+
+Modes:
+    http          the controller serves its own registry, as it always did
+    multiprocess  every process writes to PROMETHEUS_MULTIPROC_DIR and only the controller serves
+                  the merged view. The variable has to be set before prometheus_client is imported,
+                  so it belongs in the systemd units of all booth processes.
+    textfile      every process periodically writes <role>.prom into the node_exporter textfile
+                  collector directory, no process serves HTTP. Samples get a 'process' label so
+                  the files of different processes never clash.
+"""
+
+import os
+import time
+import threading
+import atexit
+import logging
+from prometheus_client import start_http_server, write_to_textfile, CollectorRegistry, REGISTRY
+from prometheus_client import multiprocess
+from prometheus_client.multiprocess import MultiProcessCollector
+
+logger = logging.getLogger('Metrics')
+logger.setLevel(logging.INFO)
+
+MULTIPROC_DIR_VARIABLE = 'PROMETHEUS_MULTIPROC_DIR'
+
+
+def start_metrics_export(role, mode='http', port=8000, textfile_directory=None, interval=15, serve=True):
+    """
+    Start exporting this process's metrics.
+
+    Args:
+        role (str): Process name, used for the textfile name.
+        mode (str): 'http', 'multiprocess' or 'textfile'.
+        serve (bool): Whether this process serves HTTP in 'http' and 'multiprocess' mode.
+            Only the controller does.
+    """
+    if mode == 'multiprocess' and not os.environ.get(MULTIPROC_DIR_VARIABLE):
+        logger.error(f"Metrics mode multiprocess needs {MULTIPROC_DIR_VARIABLE} to be set, falling back to http")
+        mode = 'http'
+
+    if mode not in ('http', 'multiprocess', 'textfile'):
+        raise ValueError(f"Unknown metrics mode '{mode}'")
+    if mode == 'textfile' and not textfile_directory:
+        raise ValueError('metrics mode textfile needs a textfile directory')
+
+    # Metrics must never keep a booth process from starting, a busy port or an unwritable
+    # directory only costs the metrics
+    try:
+        if mode == 'http':
+            if serve:
+                start_http_server(port)
+        elif mode == 'multiprocess':
+            # Drop the live gauges of this process from the shared files when it exits
+            atexit.register(multiprocess.mark_process_dead, os.getpid())
+            if serve:
+                registry = CollectorRegistry()
+                MultiProcessCollector(registry)
+                start_http_server(port, registry=registry)
+        else:
+            os.makedirs(textfile_directory, exist_ok=True)
+            path = os.path.join(textfile_directory, f"{role}.prom")
+            threading.Thread(target=_write_textfile_loop, args=(path, RoleLabelledRegistry(role), interval), daemon=True).start()
+    except OSError as e:
+        logger.error(f"Error starting {role} metrics export in {mode} mode, continuing without it: {e}")
+        return
+    logger.info(f"Exporting {role} metrics in {mode} mode")
+
+
+class RoleLabelledRegistry:
+    """View of the default registry that adds a process label to every sample."""
+
+    def __init__(self, role):
+        self.role = role
+
+    def collect(self):
+        for metric in REGISTRY.collect():
+            metric.samples = [
+                sample._replace(labels={**sample.labels, 'process': self.role})
+                for sample in metric.samples
+            ]
+            yield metric
+
+
+def _write_textfile_loop(path, registry, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            # write_to_textfile writes a temp file and renames it, the collector never sees half a file
+            write_to_textfile(path, registry)
+        except Exception as e:
+            logger.error(f"Error writing metrics to {path}: {e}")
+
+
+def start_periodic(target, interval, name):
+    """Run target every interval seconds on a daemon thread, so scrapes never wait for it."""
+    def loop():
+        while True:
+            try:
+                target()
+            except Exception as e:
+                logger.error(f"Error in periodic {name}: {e}")
+            time.sleep(interval)
+    thread = threading.Thread(target=loop, name=name, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,131 @@
+"""
+Overlay Service
+Composites an event frame and text (logo, names, date) onto the collage from a pre-rasterised cache
+"""
+
+import os
+import io
+import json
+import hashlib
+import threading
+import logging
+from datetime import date
+from PIL import Image, ImageDraw, ImageFont
+
+logger = logging.getLogger('OverlayService')
+logger.setLevel(logging.INFO)
+
+COLLAGE_SIZE = (1200, 1800)
+
+
+def load_frame(path, size):
+    """Load a PNG or SVG frame as an RGBA image of the given size."""
+    if path.lower().endswith('.svg'):
+        try:
+            import cairosvg
+        except ImportError:
+            raise RuntimeError("SVG frames need cairosvg, install it or convert the frame to PNG")
+        png = cairosvg.svg2png(url=path, output_width=size[0], output_height=size[1])
+        return Image.open(io.BytesIO(png)).convert('RGBA')
+
+    frame = Image.open(path).convert('RGBA')
+    if frame.size != size:
+        logger.warning(f"Overlay frame {path} is {frame.size[0]}x{frame.size[1]}, scaling it to {size[0]}x{size[1]}")
+        frame = frame.resize(size, Image.LANCZOS)
+    return frame
+
+
+class Overlay:
+    def __init__(self, frame_path=None, text_fields=None, size=COLLAGE_SIZE, cache_directory='overlay_cache'):
+        """
+        Args:
+            frame_path (str): PNG or SVG with transparency, drawn over the collage.
+            text_fields (list): Dicts with 'text' ({date} is replaced with today's date), 'x', 'y',
+                and optional 'size', 'color', 'font' (path to a TrueType font) and 'anchor'.
+        """
+        self.frame_path = frame_path
+        self.text_fields = text_fields or []
+        self.size = tuple(size)
+        self.cache_directory = cache_directory
+        self.cache_key = None
+        self.frame_stat = None    # (mtime, size) of the frame file when frame_digest was taken
+        self.frame_digest = None
+        self.rgb = None
+        self.alpha = None
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.frame_path or self.text_fields)
+
+    def _resolved_texts(self):
+        today = date.today().strftime('%d.%m.%Y')
+        return [dict(field, text=str(field.get('text', '')).replace('{date}', today)) for field in self.text_fields]
+
+    def _key(self, texts):
+        digest = hashlib.sha1(json.dumps([texts, self.size], sort_keys=True).encode())
+        if self.frame_path:
+            digest.update(self._frame_digest())
+        return digest.hexdigest()[:16]
+
+    def _frame_digest(self):
+        """Hash of the frame file, read again only when its mtime or size changed."""
+        stat = os.stat(self.frame_path)
+        frame_stat = (stat.st_mtime_ns, stat.st_size)
+        if frame_stat != self.frame_stat:
+            with open(self.frame_path, 'rb') as file:
+                self.frame_digest = hashlib.sha1(file.read()).digest()
+            self.frame_stat = frame_stat
+        return self.frame_digest
+
+    def _rasterise(self, texts):
+        overlay = load_frame(self.frame_path, self.size) if self.frame_path else Image.new('RGBA', self.size, (0, 0, 0, 0))
+        draw = ImageDraw.Draw(overlay)
+        for field in texts:
+            size = field.get('size', 40)
+            try:
+                font = ImageFont.truetype(field['font'], size) if field.get('font') else ImageFont.load_default(size)
+            except OSError as e:
+                logger.error(f"Error loading font {field.get('font')}: {e}")
+                font = ImageFont.load_default(size)
+            draw.text((field.get('x', 0), field.get('y', 0)), field['text'], font=font,
+                      fill=field.get('color', '#ffffff'), anchor=field.get('anchor', 'la'))
+        return overlay
+
+    def prepare(self):
+        """Rasterise the overlay if it changed, from the disk cache when this event rendered it before."""
+        texts = self._resolved_texts()
+        with self.lock:
+            key = self._key(texts)
+            if key == self.cache_key:
+                return
+            cache_path = os.path.join(self.cache_directory, f"overlay_{key}.png")
+            if os.path.isfile(cache_path):
+                with Image.open(cache_path) as cached:
+                    overlay = cached.convert('RGBA')
+                logger.info(f"Loaded overlay {key} from cache")
+            else:
+                overlay = self._rasterise(texts)
+                os.makedirs(self.cache_directory, exist_ok=True)
+                overlay.save(cache_path)
+                logger.info(f"Rasterised overlay {key}")
+            # Split once, every collage then only needs the blend
+            self.rgb, self.alpha, self.cache_key = overlay.convert('RGB'), overlay.getchannel('A'), key
+
+    def apply(self, collage):
+        """
+        Blend the overlay onto the collage.
+
+        Returns:
+            Image: The composited collage, or the collage unchanged if the overlay failed.
+        """
+        try:
+            self.prepare()
+            if collage.size != self.size:
+                logger.error(f"Collage is {collage.size[0]}x{collage.size[1]}, overlay is {self.size[0]}x{self.size[1]}, skipping overlay")
+                return collage
+            # One blend with a single rounding step: out = (overlay * alpha + collage * (255 - alpha)) / 255
+            return Image.composite(self.rgb, collage.convert('RGB'), self.alpha)
+        except Exception as e:
+            logger.error(f"Error applying overlay: {e}")
+            return collage
@@ -1,16 +1,64 @@
 import time
 import requests
 import logging
+from circuit_breaker import CircuitBreaker, CircuitOpenError
 
 logger = logging.getLogger('PaymentService')
 logger.setLevel(logging.INFO)
 
+DEFAULT_BASE_URL = "https://api.sumup.com"
+
+
 class PaymentService:
-    def __init__(self, config):
+    def __init__(self, config, webhook=None):
+        """
+        Args:
+            webhook (PaymentWebhookReceiver): Receives the payment result pushed by SumUp, polling
+                then only runs as a slow fallback. None polls every second as before.
+        """
         self.config = config
+        self.webhook = webhook
+        api_config = config.get('paymentApi', {})
+        # Point this at fake_sumup_server.py to try outages and slow responses without a terminal
+        self.base_url = api_config.get('baseUrl', DEFAULT_BASE_URL).rstrip('/')
+        self.timeout = api_config.get('timeout', 10)
+        # Public URL of the webhook receiver, SumUp posts the reader result there
+        self.return_url = api_config.get('webhookUrl') if webhook else None
+        if self.return_url:
+            separator = '&' if '?' in self.return_url else '?'
+            self.return_url += f"{separator}token={webhook.token}"
+        self.fallback_poll_seconds = api_config.get('fallbackPollSeconds', 10)
+        self.breaker = CircuitBreaker(
+            'sumup',
+            probe=self._probe,
+            window=api_config.get('breakerWindow', 10),
+            min_calls=api_config.get('breakerMinCalls', 4),
+            failure_rate=api_config.get('breakerFailureRate', 0.5),
+            slow_call_seconds=api_config.get('slowCallSeconds', 5),
+            open_seconds=api_config.get('breakerOpenSeconds', 30)
+        )
+
+    def is_available(self):
+        """False while the circuit breaker is open, payments would fail without reaching SumUp."""
+        return not self.breaker.is_open()
+
+    def _send(self, method, url, **kwargs):
+        response = requests.request(method, url, timeout=self.timeout, **kwargs)
+        # Server errors and rate limiting count against the breaker, client errors are our own fault
+        if response.status_code >= 500 or response.status_code == 429:
+            raise requests.HTTPError(f"SumUp API returned {response.status_code} {response.reason}", response=response)
+        return response
+
+    def _request(self, method, url, **kwargs):
+        return self.breaker.call(self._send, method, url, **kwargs)
+
+    def _probe(self):
+        url = f"{self.base_url}/v0.1/merchants/{self.config['merchantCode']}/readers/{self.config['readerID']}"
+        headers = {'Authorization': f"Bearer {self.config['bearerToken']}"}
+        self._send('GET', url, headers=headers)
 
     def create_checkout(self):
-        url = f"https://api.sumup.com/v0.1/merchants/{self.config['merchantCode']}/readers/{self.config['readerID']}/checkout"
+        url = f"{self.base_url}/v0.1/merchants/{self.config['merchantCode']}/readers/{self.config['readerID']}/checkout"
         headers = {
             'Authorization': f"Bearer {self.config['bearerToken']}",
             'Content-Type': 'application/json'
@@ -22,8 +70,10 @@ class PaymentService:
                 "value": self.config['payment']['value']
             }
         }
+        if self.return_url:
+            data["return_url"] = self.return_url
         try:
-            response = requests.post(url, headers=headers, json=data, timeout=10)
+            response = self._request('POST', url, headers=headers, json=data)
             response_data = response.json()
             if response.status_code in [200, 201] and 'data' in response_data and 'client_transaction_id' in response_data['data']:
                 logger.info("Checkout created successfully")
@@ -31,6 +81,9 @@ class PaymentService:
             else:
                 logger.error(f"Failed to create checkout. Status: {response.status_code}, Response: {response_data}")
                 return None
+        except CircuitOpenError as e:
+            logger.error(f"Not creating checkout, SumUp is unavailable: {str(e)}")
+            return None
         except Exception as e:
             logger.error(f"Error creating checkout: {str(e)}")
             return None
@@ -40,13 +93,13 @@ class PaymentService:
             logger.error("Client transaction ID cannot be empty")
             raise ValueError("client transaction ID cannot be empty")
 
-        url = f"https://api.sumup.com/v2.1/merchants/{self.config['merchantCode']}/transactions"
+        url = f"{self.base_url}/v2.1/merchants/{self.config['merchantCode']}/transactions"
         params = {'client_transaction_id': client_transaction_id}
         headers = {
             'Authorization': f"Bearer {self.config['bearerToken']}",
             'Content-Type': 'application/json'
         }
-        response = requests.get(url, headers=headers, params=params, timeout=10)
+        response = self._request('GET', url, headers=headers, params=params)
         if response.status_code == 200:
             data = response.json()
             # Process single transaction response
@@ -89,19 +142,73 @@ class PaymentService:
                 result = self.get_transaction_status(client_transaction_id)
                 status = result['status']
                 if status in ["SUCCESSFUL", "FAILED"]:
-                    if status == "SUCCESSFUL":
-                        logger.info(f"Final transaction status: {status}")
-                    else:  # status == "FAILED"
-                        if attempts < 43:
-                            logger.warning("Payment card not accepted by terminal or insufficient funds.")
-                            logger.warning(f"Attempts reached: {attempts}")
-                        else:
-                            logger.warning("Payment started, but no one paid. Payment cancelled after 1 minute.")
-                            logger.error(f"Attempts reached: {attempts}")
+                    self._log_final_status(status, attempts)
                     return result
                 time.sleep(interval_ms / 1000)
+            except CircuitOpenError:
+                # Keep waiting without requests, the customer may already be paying and the
+                # background probe can close the breaker before the attempts run out
+                logger.debug(f"SumUp unavailable, skipping status request (attempt {attempts})")
+                time.sleep(interval_ms / 1000)
             except Exception as e:
                 logger.error(f"Error polling status (attempt {attempts}): {str(e)}")
                 time.sleep(interval_ms / 1000)
         logger.error("Transaction polling reached maximum attempts")
         return {'status': 'FAILED', 'transaction_code': None}
+
+    def _log_final_status(self, status, attempts):
+        """attempts is the number of one-second polls (or seconds waited) it took."""
+        if status == "SUCCESSFUL":
+            logger.info(f"Final transaction status: {status}")
+        else:  # status == "FAILED"
+            if attempts < 43:
+                logger.warning("Payment card not accepted by terminal or insufficient funds.")
+                logger.warning(f"Attempts reached: {attempts}")
+            else:
+                logger.warning("Payment started, but no one paid. Payment cancelled after 1 minute.")
+                logger.error(f"Attempts reached: {attempts}")
+
+    def wait_for_transaction_status(self, client_transaction_id, timeout=64):
+        """
+        Wait for the webhook to announce the final status, polling the API only every
+        fallback_poll_seconds in case a webhook gets lost. The status always comes from the API.
+
+        Returns:
+            dict: {'status', 'transaction_code'} like poll_transaction_status.
+        """
+        if not self.webhook:
+            return self.poll_transaction_status(client_transaction_id)
+
+        start_time = time.time()
+        confirming = False
+        try:
+            while time.time() - start_time < timeout:
+                # After a webhook the API may lag behind it for a moment, check it again soon
+                poll_seconds = 1 if confirming else self.fallback_poll_seconds
+                wait_seconds = min(poll_seconds, timeout - (time.time() - start_time))
+                notified = self.webhook.wait(client_transaction_id, wait_seconds)
+                source = 'webhook' if notified or confirming else 'poll'
+                if notified:
+                    # Anyone who can reach the receiver can post a webhook, it only says when to
+                    # ask the API, the API's answer is the status that counts
+                    confirming = True
+                    logger.info(f"Payment webhook reported {notified['status']}, confirming with the API")
+                try:
+                    result = self.get_transaction_status(client_transaction_id)
+                except CircuitOpenError:
+                    continue
+                except Exception as e:
+                    logger.error(f"Error reading transaction status: {str(e)}")
+                    continue
+
+                status = result['status']
+                if status not in ["SUCCESSFUL", "FAILED"]:
+                    continue
+                logger.info(f"Payment status {status} received by {source} after {time.time() - start_time:.1f}s")
+                self._log_final_status(status, int(time.time() - start_time) + 1)
+                return result
+        finally:
+            self.webhook.forget(client_transaction_id)
+
+        logger.error("Transaction polling reached maximum attempts")
+        return {'status': 'FAILED', 'transaction_code': None}
@@ -0,0 +1,129 @@
+"""
+Payment Webhook
+Small HTTP listener the SumUp checkout return_url points at, wakes the waiting payment as soon as
+the reader reports the result
+"""
+
+import json
+import time
+import hmac
+import threading
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from prometheus_client import Counter
+
+logger = logging.getLogger('PaymentWebhook')
+logger.setLevel(logging.INFO)
+
+PAYMENT_WEBHOOKS = Counter('payment_webhooks_total', 'Payment webhook requests by outcome', ['result'])
+
+WEBHOOK_PATH = '/sumup/webhook'
+
+
+class PaymentWebhookReceiver:
+    def __init__(self, port=8002, token=None, keep_seconds=600, host=''):
+        """
+        Args:
+            token (str): Shared secret that must be in the return URL's token parameter, so only
+                SumUp (who got the URL with the checkout) can report payments. Required, even
+                though the payment service confirms every reported status with the API.
+            keep_seconds (float): How long unclaimed results are kept.
+            host (str): Address to listen on, all interfaces by default.
+        """
+        if not token:
+            raise ValueError('payment webhook needs a token')
+        self.host = host
+        self.port = port
+        self.token = token
+        self.keep_seconds = keep_seconds
+        self.results = {}  # client transaction id -> (received time, result)
+        self.events = {}   # client transaction id -> Event someone waits on
+        self.lock = threading.Lock()
+        self.server = None
+
+    def start(self):
+        handler = lambda *args, **kwargs: PaymentWebhookHandler(self, *args, **kwargs)
+        self.server = ThreadingHTTPServer((self.host, self.port), handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='payment-webhook', daemon=True).start()
+        logger.info(f"Payment webhook listening on {self.host or '*'}:{self.port}")
+
+    def deliver(self, client_transaction_id, result):
+        with self.lock:
+            now = time.time()
+            self.results = {key: value for key, value in self.results.items() if now - value[0] < self.keep_seconds}
+            self.results[client_transaction_id] = (now, result)
+            event = self.events.get(client_transaction_id)
+        if event:
+            event.set()
+
+    def wait(self, client_transaction_id, timeout):
+        """
+        Wait up to timeout seconds for the webhook of a transaction.
+
+        Returns:
+            dict: {'status', 'transaction_code'} as reported by the webhook, unverified, or None if none arrived.
+        """
+        with self.lock:
+            if client_transaction_id in self.results:
+                return self.results.pop(client_transaction_id)[1]
+            event = self.events.setdefault(client_transaction_id, threading.Event())
+        event.wait(timeout)
+        with self.lock:
+            received = self.results.pop(client_transaction_id, None)
+            if received:
+                self.events.pop(client_transaction_id, None)
+        return received[1] if received else None
+
+    def forget(self, client_transaction_id):
+        with self.lock:
+            self.events.pop(client_transaction_id, None)
+            self.results.pop(client_transaction_id, None)
+
+
+class PaymentWebhookHandler(BaseHTTPRequestHandler):
+    def __init__(self, receiver, *args, **kwargs):
+        self.receiver = receiver
+        super().__init__(*args, **kwargs)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _reply(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        parsed = urlparse(self.path)
+        if parsed.path != WEBHOOK_PATH:
+            self._reply(404)
+            return
+        token = parse_qs(parsed.query).get('token', [''])[0]
+        if not hmac.compare_digest(token, self.receiver.token):
+            PAYMENT_WEBHOOKS.labels(result='rejected').inc()
+            logger.warning(f"Payment webhook with a wrong token from {self.client_address[0]}")
+            self._reply(403)
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length))
+            # Reader checkout events carry the result in 'payload', accept a flat body as well
+            payload = body.get('payload', body)
+            client_transaction_id = payload['client_transaction_id']
+            status = payload['status'].upper()
+        except (ValueError, KeyError, AttributeError) as e:
+            PAYMENT_WEBHOOKS.labels(result='invalid').inc()
+            logger.error(f"Invalid payment webhook: {e}")
+            self._reply(400)
+            return
+
+        self.receiver.deliver(client_transaction_id, {
+            'status': status,
+            'transaction_code': payload.get('transaction_code'),
+        })
+        PAYMENT_WEBHOOKS.labels(result='accepted').inc()
+        logger.info(f"Payment webhook for {client_transaction_id}: {status}")
+        self._reply(200)
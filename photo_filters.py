@@ -0,0 +1,80 @@
+"""
+Photo Filters
+Looks like B&W or sepia as precomputed lookup tables, applied to the collage tiles
+"""
+
+import logging
+import threading
+import time
+from PIL import ImageFilter
+
+logger = logging.getLogger('PhotoFilters')
+logger.setLevel(logging.INFO)
+
+LUT_SIZE = 17
+
+
+def _clamp(value):
+    return max(0, min(255, int(round(value))))
+
+
+def _curve_table(red, green, blue):
+    """768 entry table for Image.point from one curve per channel."""
+    return [_clamp(red(v)) for v in range(256)] + [_clamp(green(v)) for v in range(256)] + [_clamp(blue(v)) for v in range(256)]
+
+
+def _contrast(amount):
+    return lambda v: 128 + (v - 128) * amount
+
+
+def _luma(r, g, b):
+    return 0.299 * r + 0.587 * g + 0.114 * b
+
+
+# Looks that keep the channels apart are a per-channel curve (Image.point), looks that mix the
+# channels are a 3D LUT (ImageFilter.Color3DLUT, callbacks work on 0.0-1.0 values)
+PRESETS = {
+    'none': None,
+    'bw': ('3d', lambda r, g, b: (_luma(r, g, b),) * 3),
+    'sepia': ('3d', lambda r, g, b: (
+        min(1.0, 0.393 * r + 0.769 * g + 0.189 * b),
+        min(1.0, 0.349 * r + 0.686 * g + 0.168 * b),
+        min(1.0, 0.272 * r + 0.534 * g + 0.131 * b),
+    )),
+    'warm': ('curves', (lambda v: v * 1.08 + 4, lambda v: v * 1.02, lambda v: v * 0.88)),
+    'high_contrast': ('curves', (_contrast(1.35),) * 3),
+}
+
+# Built on first use and shared, a 3D LUT takes LUT_SIZE^3 callback calls to generate
+_lut_cache = {}
+_lut_cache_lock = threading.Lock()
+
+
+def get_lut(name):
+    """Return the lookup table for a preset, a point table or a Color3DLUT filter, or None for 'none'."""
+    if name not in PRESETS:
+        raise ValueError(f"Unknown filter '{name}', expected one of {', '.join(PRESETS)}")
+    if PRESETS[name] is None:
+        return None
+    with _lut_cache_lock:
+        lut = _lut_cache.get(name)
+        if lut is None:
+            start_time = time.time()
+            kind, definition = PRESETS[name]
+            if kind == 'curves':
+                lut = _curve_table(*definition)
+            else:
+                lut = ImageFilter.Color3DLUT.generate(LUT_SIZE, definition)
+            _lut_cache[name] = lut
+            logger.info(f"Built {name} filter table in {time.time() - start_time:.3f}s")
+        return lut
+
+
+def apply_filter(image, name):
+    """Apply a preset to an RGB image, returns the image unchanged for 'none'."""
+    lut = get_lut(name)
+    if lut is None:
+        return image
+    if isinstance(lut, list):
+        return image.point(lut)
+    return image.filter(lut)
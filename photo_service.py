@@ -3,43 +3,208 @@ import os
 import time
 import logging
 import signal
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image, ImageOps, ImageDraw
+from prometheus_client import Counter, Histogram
+
+from camera_backends import Gphoto2Camera, FakeCamera, parse_camera_port
+from render_budget import TIERS
+from photo_filters import get_lut, apply_filter
 
 logger = logging.getLogger('PhotoService')
 logger.setLevel(logging.INFO)
 
+# shot is first_warm or first_cold for the first frame of a session, depending on whether the
+# pre-warm kept the camera awake, and later for the other frames
+CAPTURE_SECONDS = Histogram(
+    'camera_capture_download_seconds', 'Time to capture and download one frame per camera, profile and shot', ['camera', 'profile', 'shot'],
+    buckets=(0.5, 1, 1.5, 2, 2.5, 3, 4, 5, 7.5, 10, 15)
+)
+CAPTURE_BYTES = Histogram(
+    'camera_capture_bytes', 'Size of one downloaded frame per camera and profile', ['camera', 'profile'],
+    buckets=(250e3, 500e3, 1e6, 2e6, 3e6, 4e6, 6e6, 8e6, 10e6, 15e6, 20e6)
+)
+CAMERA_KEEPALIVES = Counter('camera_keepalives_total', 'Pre-warm keep-alive calls per camera and outcome', ['camera', 'result'])
+
 class PhotoService:
-    def __init__(self, photos_dir='photos', max_photos=4):
+    def __init__(self, photos_dir='photos', max_photos=4, camera_ports=None, camera_backend='gphoto2', render_budget=None, overlay=None, filter_name='none',
+                 capture_profiles=None, layout=None, keepalive_interval=20, keepalive_key='batterylevel'):
+        """
+        Args:
+            camera_ports (list or str): gphoto2 ports such as 'usb:001,005', 'auto' to use every
+                detected camera, or None to drive only the default camera. The first camera is
+                the primary one, its frames go into the collage.
+            camera_backend (str): 'gphoto2', or 'fake' to run without cameras.
+            render_budget (RenderBudget): Picks the collage render tier, None always renders at
+                full quality.
+            overlay (Overlay): Event frame and text composited onto every collage, or None.
+            filter_name (str): Filter preset applied to the collage tiles, see photo_filters.PRESETS.
+            capture_profiles (CaptureProfiles): Camera settings to apply, None leaves the cameras as they are.
+            layout (str): Print layout, picks the capture profile.
+            keepalive_interval (float): Seconds between keep-alive calls while pre-warming.
+            keepalive_key (str): Camera config value read as keep-alive, any cheap readable key works.
+        """
         self.photos_dir = photos_dir
+        self.render_budget = render_budget
+        self.overlay = overlay
+        self.set_filter(filter_name)
+        self.capture_profiles = capture_profiles
+        self.layout = layout
+        self.keepalive_interval = keepalive_interval
+        self.keepalive_key = keepalive_key
+        # gphoto2 gets one camera session at a time, keep-alives and captures must not overlap
+        self.camera_lock = threading.Lock()
+        self.prewarm_stop = threading.Event()
+        self.prewarm_stop.set()
+        self.warm_until = 0
         self.max_photos = max_photos
-        self.current_photo_count = 0
         os.makedirs(self.photos_dir, exist_ok=True)
+        self.camera_backend = camera_backend
+        self.cameras = self._create_cameras(camera_ports, camera_backend)
+        # One worker per camera so every camera is triggered at the same time
+        self.capture_executor = ThreadPoolExecutor(max_workers=len(self.cameras), thread_name_prefix='camera')
+
+    def set_filter(self, filter_name):
+        # Build the table now, so neither the first session nor a typo waits until the collage
+        get_lut(filter_name)
+        self.filter_name = filter_name
+
+    def _create_cameras(self, camera_ports, camera_backend):
+        if camera_ports == 'auto':
+            detected, camera_lines = self.detect_connected_cameras()
+            camera_ports = [parse_camera_port(line) for line in camera_lines] if detected else None
+        if camera_backend == 'fake':
+            return [FakeCamera(port=port) for port in (camera_ports or ['fake:0'])]
+        if not camera_ports:
+            return [Gphoto2Camera()]
+        return [Gphoto2Camera(port) for port in camera_ports]
+
+    def _photo_path(self, camera_index, photo_number):
+        if camera_index == 0:
+            return os.path.join(self.photos_dir, f"photo_{photo_number:04d}.jpg")
+        return os.path.join(self.photos_dir, f"cam{camera_index + 1}_photo_{photo_number:04d}.jpg")
+
+    def apply_capture_profile(self, force=False):
+        """
+        Apply the layout's capture profile to every camera, all cameras at once.
 
-    def take_photo(self):
-        try:
-            subprocess.run([
-                'gphoto2', '--capture-image-and-download',
-                '--filename', os.path.join(self.photos_dir, f"photo_{self.current_photo_count + 1:04d}.jpg")
-            ], check=True)
-            self.current_photo_count += 1
-            return self.get_latest_photo_path()
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Error taking photo: {e}")
-            return None
-        except Exception as e:
-            logger.exception(f"Unexpected error during photo capture: {e}")
-            return None
+        Returns:
+            bool: True if every camera has the profile (or there is none to apply).
+        """
+        if not self.capture_profiles:
+            return True
+        profile_name = self.capture_profiles.profile_for(self.layout)
+        futures = [
+            self.capture_executor.submit(self.capture_profiles.apply, camera, profile_name, force)
+            for camera in self.cameras
+        ]
+        return all(future.result() for future in futures)
+
+    def apply_capture_profile_in_background(self, force=False):
+        """apply_capture_profile() on its own thread, under the camera lock like the keep-alives."""
+        def apply():
+            with self.camera_lock:
+                self.apply_capture_profile(force=force)
+        threading.Thread(target=apply, name='capture-profile', daemon=True).start()
+
+    def start_prewarm(self, force_profile=False):
+        """
+        Wake the cameras, apply the capture profile and keep them awake until stop_prewarm(), so
+        the first shot does not pay for power save wake-up.
+        """
+        if not self.prewarm_stop.is_set():
+            return
+        # Every run gets its own stop event, a run that is still finishing a keep-alive after
+        # stop_prewarm() keeps seeing its event set and cannot turn into a second loop
+        stop = threading.Event()
+        self.prewarm_stop = stop
+        threading.Thread(target=self._prewarm_loop, args=(stop, force_profile), name='camera-prewarm', daemon=True).start()
+
+    def stop_prewarm(self):
+        self.prewarm_stop.set()
+
+    def _prewarm_loop(self, stop, force_profile):
+        with self.camera_lock:
+            if stop.is_set():
+                return
+            self.apply_capture_profile(force=force_profile)
+            self._keep_alive()
+        while not stop.wait(self.keepalive_interval):
+            with self.camera_lock:
+                if stop.is_set():
+                    break
+                self._keep_alive()
+
+    def _keep_alive(self):
+        futures = [
+            self.capture_executor.submit(camera.get_config, [self.keepalive_key])
+            for camera in self.cameras
+        ]
+        all_ok = True
+        for camera, future in zip(self.cameras, futures):
+            try:
+                future.result()
+                CAMERA_KEEPALIVES.labels(camera=camera.name, result='success').inc()
+            except Exception as e:
+                all_ok = False
+                logger.warning(f"Keep-alive on camera {camera.name} failed: {e}")
+                CAMERA_KEEPALIVES.labels(camera=camera.name, result='failure').inc()
+        if all_ok:
+            self.warm_until = time.time() + self.keepalive_interval * 1.5
+
+    def _capture(self, camera, photo_path, shot):
+        start_time = time.time()
+        camera.capture(photo_path)
+        profile = camera.profile or 'unmanaged'
+        CAPTURE_SECONDS.labels(camera=camera.name, profile=profile, shot=shot).observe(time.time() - start_time)
+        CAPTURE_BYTES.labels(camera=camera.name, profile=profile).observe(os.path.getsize(photo_path))
+        return photo_path
+
+    def take_photo(self, session):
+        """
+        Trigger every camera at once, wait for all downloads and add the frames to the session.
 
-    def get_latest_photo_path(self):
-        try:
-            files = [os.path.join(self.photos_dir, f) for f in os.listdir(self.photos_dir) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-            return max(files, key=os.path.getctime)
-        except ValueError:
-            logger.warning("No photos found in the directory.")
-            return None
+        Returns:
+            str: Path to the primary camera's photo, or None if no camera delivered one. When the
+                primary camera fails a spare camera's photo takes its place.
+        """
+        photo_number = session.frame_count + 1
+        self.stop_prewarm()
+        if photo_number == 1:
+            shot = 'first_warm' if time.time() < self.warm_until else 'first_cold'
+        else:
+            shot = 'later'
+
+        # Waits for a keep-alive that is still running
+        with self.camera_lock:
+            futures = [
+                self.capture_executor.submit(self._capture, camera, self._photo_path(index, photo_number), shot)
+                for index, camera in enumerate(self.cameras)
+            ]
+
+            photo_paths = []
+            for camera, future in zip(self.cameras, futures):
+                try:
+                    photo_paths.append(future.result())
+                except subprocess.CalledProcessError as e:
+                    logger.error(f"Error taking photo on camera {camera.name}: {e}")
+                    photo_paths.append(None)
+                except Exception as e:
+                    logger.exception(f"Unexpected error during photo capture on camera {camera.name}: {e}")
+                    photo_paths.append(None)
+
+        primary_path = self._photo_path(0, photo_number)
+        if photo_paths[0] is None:
+            spare_path = next((path for path in photo_paths if path), None)
+            if spare_path is None:
+                return None
+            logger.warning(f"Primary camera failed, using photo from spare camera: {spare_path}")
+            shutil.copy2(spare_path, primary_path)
 
-    def reset_photo_count(self):
-        self.current_photo_count = 0
+        session.add_frame(primary_path, [path for path in photo_paths[1:] if path])
+        return primary_path
 
     def kill_gphoto2_process(self):
         try:
@@ -57,8 +222,15 @@ class PhotoService:
             logger.exception(f"Error while killing gphoto2 processes: {e}")
             return False
 
-    def detect_connected_cameras(self):
-        """Detect connected cameras using gphoto2."""
+    def detect_connected_cameras(self, report=True):
+        """
+        Detect connected cameras using gphoto2.
+
+        Args:
+            report (bool): Log the outcome. Background health checks pass False, the "Cannot start
+                transaction" lines are counted as failed transaction starts.
+        """
+        log_failure = logger.error if report else logger.debug
         try:
             # Kill any existing gphoto2 processes first
             self.kill_gphoto2_process()
@@ -80,27 +252,29 @@ class PhotoService:
                             camera_lines.append(line)
                 
                 if camera_lines:
-                    logger.info(f"Connected cameras found: {len(camera_lines)}")
+                    (logger.info if report else logger.debug)(f"Connected cameras found: {len(camera_lines)}")
                     return True, camera_lines
                 else:
-                    logger.error("No connected cameras detected - Cannot start transaction")
+                    log_failure("No connected cameras detected - Cannot start transaction")
                     return False, []
             else:
-                logger.error("No connected cameras detected - Cannot start transaction. gphoto2 error 1")
+                log_failure("No connected cameras detected - Cannot start transaction. gphoto2 error 1")
                 return False, []
                 
         except FileNotFoundError:
-            logger.error("No connected cameras detected - Cannot start transaction. gphoto2 error 2")
+            log_failure("No connected cameras detected - Cannot start transaction. gphoto2 error 2")
             return False, []
         except subprocess.TimeoutExpired:
-            logger.error("No connected cameras detected - Cannot start transaction. gphoto2 error 3")
+            log_failure("No connected cameras detected - Cannot start transaction. gphoto2 error 3")
             return False, []
         except Exception as e:
-            logger.error("No connected cameras detected - Cannot start transaction. gphoto2 error 4")
+            log_failure("No connected cameras detected - Cannot start transaction. gphoto2 error 4")
             return False, []
 
     def is_camera_ready(self):
         """Check if at least one camera is connected and ready."""
+        if self.camera_backend == 'fake':
+            return True
         try:
             gphoto2_detected, connected_cameras = self.detect_connected_cameras()
             if gphoto2_detected and connected_cameras:
@@ -112,13 +286,15 @@ class PhotoService:
             logger.error(f"Error checking camera readiness: {e}")
             return False
 
-    def create_final_photo(self, quality=100, optimize=False):
+    def create_final_photo(self, session, quality=100, optimize=False):
         """
-        Creates a 1200x1800 collage with adjustable line and border widths.
+        Creates a 1200x1800 collage with adjustable line and border widths from the session's frames.
 
         Parameters:
+            session (Session): Session whose frames go into the collage, gets the collage path.
             quality (int): JPEG quality (1-100). Default is 100.
             optimize (bool): Whether to optimize the image, effectively reducing file size. Default is False.
+                With a render budget the chosen tier sets quality and optimize instead.
 
         Returns:
             str: Path to the saved collage image, or None if an error occurs.
@@ -126,18 +302,20 @@ class PhotoService:
         try:
             logger.info("Creating final photo collage...")
 
-            # Gather Photo Files
-            photo_files = sorted([
-                os.path.join(self.photos_dir, f)
-                for f in os.listdir(self.photos_dir)
-                if f.lower().endswith(('.jpg', '.jpeg', '.png'))
-            ])
+            photo_files = session.frames
 
             expected_photos = 4
             if len(photo_files) != expected_photos:
                 logger.error(f"Expected 4 photos, but found {len(photo_files)}")
                 return None
 
+            start_time = time.time()
+            if self.render_budget:
+                tier = self.render_budget.choose()
+                quality, optimize = tier['quality'], tier['optimize']
+            else:
+                tier = TIERS[0]
+
             # Open Images
             images = [Image.open(photo) for photo in photo_files]
 
@@ -165,25 +343,32 @@ class PhotoService:
 
             # Arrange Photos
             for i in range(4):
-                for j in range(2):
-                    img = images[i]
+                img = images[i]
 
-                    # Resize maintaining height and center crop width
-                    img_aspect_ratio = img.width / img.height
-                    new_height = image_height
-                    new_width = int(new_height * img_aspect_ratio)
+                # Resize maintaining height and center crop width
+                img_aspect_ratio = img.width / img.height
+                new_height = image_height
+                new_width = int(new_height * img_aspect_ratio)
 
-                    img_resized = img.resize((new_width, new_height), Image.LANCZOS)
+                if tier['draft_factor']:
+                    # Let the JPEG decoder skip detail the tile cannot show
+                    img.draft('RGB', (new_width * tier['draft_factor'], new_height * tier['draft_factor']))
+                img_resized = img.resize((new_width, new_height), tier['resample'])
 
-                    left = (new_width - image_width) // 2
-                    img_cropped = img_resized.crop((left, 0, left + image_width, new_height))
+                left = (new_width - image_width) // 2
+                img_cropped = img_resized.crop((left, 0, left + image_width, new_height))
+                # At tile size the filter touches a twentieth of the pixels of a camera frame
+                img_cropped = apply_filter(img_cropped, self.filter_name)
 
+                # Both columns show the same photo, resized once
+                for j in range(2):
                     # Calculate position to center the image
                     x = j * image_width + j * middle_line_thickness + border_width_left
                     y = i * (image_height + row_line_thickness) + border_width_top
 
                     # Paste image on collage
                     collage.paste(img_cropped, (x, y))
+                img.close()
 
             # Draw lines for separation
             draw = ImageDraw.Draw(collage)
@@ -204,9 +389,15 @@ class PhotoService:
                             (collage_width - border_width_right, collage_height - border_width_bottom)],
                            outline=border_color, width=1)
 
+            if self.overlay:
+                collage = self.overlay.apply(collage)
+
             # Save the Collage
             collage_path = os.path.join(self.photos_dir, "final_collage.jpg")
             collage.save(collage_path, quality=quality, optimize=optimize)
+            session.collage_path = collage_path
+            if self.render_budget:
+                self.render_budget.record(tier, time.time() - start_time)
 
             # Log Information
             collage_size_mb = os.path.getsize(collage_path) / (1024 * 1024)
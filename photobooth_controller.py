@@ -4,8 +4,7 @@ import os
 import signal
 from enum import Enum
 import logging
-from prometheus_client import start_http_server, Counter, Gauge, Histogram, write_to_textfile, REGISTRY
-from prometheus_client.multiprocess import MultiProcessCollector
+from prometheus_client import Counter, Gauge, Histogram
 import json
 import sys
 
@@ -15,7 +14,20 @@ from payment_service import PaymentService
 from sound_service import SoundService
 from photo_service import PhotoService
 from printer_service import PrinterService
+from gallery_service import ArchiveGallery
+from render_budget import RenderBudget
+from overlay_service import Overlay
+from photo_filters import PRESETS
+from camera_profiles import CaptureProfiles
+from reprint_cache import ReprintCache
+from animation_service import AnimationService
+from payment_webhook import PaymentWebhookReceiver
+from device_recovery import DeviceRecovery
 from config_loader import load_config
+import tracing
+import metrics
+from session import Session
+from session_journal import SessionJournal, SESSION_STARTED, PAYMENT_SUCCESSFUL, FRAME_CAPTURED, COLLAGE_CREATED, PRINT_SUBMITTED, PRINT_COMPLETED, SESSION_CLOSED
 
 # At the top of the file, after imports
 logger = logging.getLogger('PhotoboothController')
@@ -49,18 +61,101 @@ class State(Enum):
 class PhotoboothController:
     def __init__(self, config_file='config.json'):
         self.config = load_config(config_file)
+        tracing_config = self.config.get('tracing', {})
+        if tracing_config.get('enabled', False):
+            tracing.configure(
+                trace_file=tracing_config.get('file', tracing.DEFAULT_TRACE_FILE),
+                max_mb=tracing_config.get('maxMb', 10),
+                backups=tracing_config.get('backups', 3)
+            )
         self.led_manager = LEDManager()
         self.sound_service = SoundService()
-        self.photo_service = PhotoService(photos_dir=self.config.get('photos_dir', 'photos'), max_photos=4)
-        self.printer_service = PrinterService()
+        camera_config = self.config.get('cameras', {})
+        print_config = self.config.get('print', {})
+        layout = print_config.get('media', '4x6')
+        if print_config.get('splitCollageIntoStrips', False):
+            layout += '-strips'
+        # 'startup' applies the capture profile once, 'session' checks it again while pre-warming
+        self.capture_profile_mode = camera_config.get('applyProfile', 'startup')
+        render_config = self.config.get('render', {})
+        render_budget = None
+        if render_config.get('adaptive', False):
+            render_budget = RenderBudget(
+                budget_seconds=render_config.get('budgetSeconds', 3.0),
+                temperature_limit=render_config.get('temperatureLimit', 75.0)
+            )
+        self.photo_service = PhotoService(
+            photos_dir=self.config.get('photos_dir', 'photos'),
+            max_photos=4,
+            camera_ports=camera_config.get('ports'),
+            camera_backend=camera_config.get('backend', 'gphoto2'),
+            render_budget=render_budget,
+            overlay=self._create_overlay(self.config.get('overlay', {})),
+            filter_name=self.config.get('filters', {}).get('preset', 'none'),
+            capture_profiles=CaptureProfiles(
+                profiles=camera_config.get('profiles'),
+                layout_profiles=camera_config.get('layoutProfiles'),
+                default_profile=camera_config.get('defaultProfile')
+            ),
+            layout=layout,
+            keepalive_interval=camera_config.get('keepaliveInterval', 20),
+            keepalive_key=camera_config.get('keepaliveKey', 'batterylevel')
+        )
+        gallery_config = self.config.get('gallery', {})
+        self.gallery = None
+        if gallery_config.get('enabled', False):
+            self.gallery = ArchiveGallery(
+                cache_directory=gallery_config.get('cacheDirectory', 'gallery_cache'),
+                max_cache_mb=gallery_config.get('cacheMaxMb', 200)
+            )
+        self.printer_service = PrinterService(
+            printer_names=print_config.get('printers'),
+            media=print_config.get('media', '4x6'),
+            split_collage_into_strips=print_config.get('splitCollageIntoStrips', False),
+            icc_profile=print_config.get('iccProfile'),
+            rendering_intent=print_config.get('renderingIntent', 'perceptual'),
+            print_mode=print_config.get('mode', 'jpeg'),
+            dpi=print_config.get('dpi', 300),
+            gallery=self.gallery,
+            reprint_cache=self._create_reprint_cache(self.config.get('reprint', {}))
+        )
+        animation_config = self.config.get('animation', {})
+        self.animation_service = None
+        if animation_config.get('enabled', False):
+            self.animation_service = AnimationService(
+                output_directory=self.printer_service.archive_directory,
+                output_format=animation_config.get('format', 'gif'),
+                size=animation_config.get('size', 800),
+                frame_seconds=animation_config.get('frameSeconds', 0.4),
+                loops=animation_config.get('loops', 3)
+            )
         self.button_manager = ButtonManager(
             button1_callback=self._on_button1_pressed,
-            button2_callback=self._on_button2_pressed
+            button2_callback=self._on_button2_pressed,
+            gestures=self._button_gestures()
+        )
+        payment_api_config = self.config.get('paymentApi', {})
+        self.payment_webhook = None
+        if payment_api_config.get('statusMode', 'poll') == 'webhook':
+            if payment_api_config.get('webhookToken'):
+                self.payment_webhook = PaymentWebhookReceiver(
+                    port=payment_api_config.get('webhookPort', 8002),
+                    token=payment_api_config['webhookToken'],
+                    host=payment_api_config.get('webhookHost', '')
+                )
+            else:
+                logger.error("Payment status mode webhook needs a webhookToken, polling instead")
+        self.payment_service = PaymentService(self.config, webhook=self.payment_webhook)
+        journal_config = self.config.get('journal', {})
+        self.journal = SessionJournal(
+            path=journal_config.get('file', 'photobooth_journal.jsonl'),
+            commit_interval=journal_config.get('commitInterval', 0.2),
+            max_kb=journal_config.get('maxKb', 1024)
         )
-        self.payment_service = PaymentService(self.config)
         self.state = State.IDLE
-        self.current_transaction_id = None
-        self.transaction_code = None
+        self.session = None
+        # (transaction code, deadline) of the last failed print, the only print the button may repeat
+        self.failed_print = None
         self.photo_lock = threading.Lock()
 
         # Track the last state change time
@@ -71,10 +166,44 @@ class PhotoboothController:
         self.watchdog_thread = threading.Thread(target=self._inactivity_watchdog, daemon=True)
         self.watchdog_thread.start()
 
+        recovery_config = self.config.get('recovery', {})
+        self.device_recovery = None
+        if recovery_config.get('enabled', True):
+            self.device_recovery = DeviceRecovery(
+                self.photo_service, self.printer_service, self.sound_service,
+                is_busy=lambda: self.state != State.IDLE,
+                interval=recovery_config.get('interval', 30),
+                settle_seconds=recovery_config.get('settleSeconds', 5)
+            )
+
         signal.signal(signal.SIGTERM, self._handle_shutdown)
         signal.signal(signal.SIGINT, self._handle_shutdown)
 
+    def _create_overlay(self, overlay_config):
+        overlay = Overlay(
+            frame_path=overlay_config.get('frame') or None,
+            text_fields=overlay_config.get('texts'),
+            cache_directory=overlay_config.get('cacheDirectory', 'overlay_cache')
+        )
+        if not overlay.enabled:
+            return None
+        try:
+            # Rasterise at startup so the first customer does not pay for it
+            overlay.prepare()
+        except Exception as e:
+            logger.error(f"Error preparing overlay: {e}")
+        return overlay
+
+    def _create_reprint_cache(self, reprint_config):
+        if not reprint_config.get('enabled', True):
+            return None
+        return ReprintCache(
+            directory=reprint_config.get('directory', 'reprint_cache'),
+            max_mb=reprint_config.get('maxMb', 300)
+        )
+
     def cleanup_photos_directory(self):
+        """Remove files no session owns, left behind by a crash. Only needed at startup."""
         photos_dir = self.photo_service.photos_dir
         try:
             if os.path.exists(photos_dir):
@@ -107,31 +236,118 @@ class PhotoboothController:
 
     def _on_button1_pressed(self):
         if self.state == State.IDLE:
+            # A new customer must not be able to retry the previous customer's print
+            self.failed_print = None
+            self.session = Session()
+            tracing.start_session(self.session.session_id)
+            self.journal.record(self.session.session_id, SESSION_STARTED)
             if self.config['demo'] == True:  # Python uses True, not true
                 self.led_manager.stop_pulsing_button1()
                 self.payment_successful()
             else:
-                self.initiate_payment()
+                with tracing.span('initiate_payment'):
+                    self.initiate_payment()
 
     def _on_button2_pressed(self):
         if self.state == State.PHOTO_PULSING:
             self.initiate_photo_capture()
             self.sound_service.play_timer_audio()
 
+    def _button_gestures(self):
+        gestures = {'both_held': self._on_staff_reset}
+        if self.config.get('filters', {}).get('cycleWithButton', False):
+            gestures['button2_held'] = self._on_cycle_filter
+        if self.config.get('reprint', {}).get('buttonGesture', False):
+            gestures['button1_held'] = self._on_reprint_last
+        return gestures
+
+    def _on_reprint_last(self):
+        """
+        Button 1 held while idle, shortly after a print failed: retry that print, for example
+        after a jam. Anything else would let anyone reprint the previous customer's photos.
+        """
+        if self.state != State.IDLE:
+            return
+        failed_print, self.failed_print = self.failed_print, None
+        if failed_print is None or time.monotonic() > failed_print[1]:
+            logger.info("Reprint gesture ignored, no recently failed print to retry")
+            return
+        transaction_code = failed_print[0]
+        logger.info(f"Reprint of the failed print of transaction {transaction_code} requested")
+        self._update_state(State.PHOTO_PRINTING)
+        self.led_manager.stop_pulsing_button1()
+        self.led_manager.set_button1_color(0, 1, 0)
+        if self.printer_service.reprint(transaction_code):
+            self.led_manager.flash_button_green(3)
+        else:
+            self.led_manager.flash_button_red(5)
+        self.reset_to_idle()
+
+    def _on_cycle_filter(self):
+        """Button 2 held while idle: switch to the next filter preset for the following sessions."""
+        if self.state != State.IDLE:
+            return
+        names = list(PRESETS)
+        current = self.photo_service.filter_name
+        next_filter = names[(names.index(current) + 1) % len(names)]
+        self.photo_service.set_filter(next_filter)
+        logger.info(f"Filter switched to {next_filter}")
+        # One blink per position in the list, so staff can tell which filter is active
+        self.led_manager.stop_pulsing_button1()
+        self.led_manager.flash_button1_green(names.index(next_filter) + 1)
+        self.led_manager.start_pulsing_button1()
+
+    def _report_device_failure(self, device):
+        if self.device_recovery:
+            self.device_recovery.report_failure(device)
+
+    def _on_staff_reset(self):
+        """Both buttons held: staff abort whatever is going on and return to idle."""
+        logger.warning(f"Staff reset requested in state {self.state}")
+        session = self.session
+        if self.state == State.IDLE or session is None:
+            return
+        if self.state == State.PHOTO_PULSING:
+            # Waiting for the customer, no thread is working on the session
+            self.reset_to_idle(session)
+        else:
+            # Resetting here would race the thread that owns the session, it resets at its next step
+            session.aborted = True
+
+    def _abort_if_requested(self, session):
+        """Reset to idle if staff aborted the session. Returns True if it was aborted."""
+        if not session.aborted:
+            return False
+        logger.warning(f"Session {session.session_id} aborted by staff")
+        self.reset_to_idle(session)
+        return True
+
     def initiate_payment(self):
         logger.info("Initiating payment...")
 
         self.led_manager.stop_pulsing_button1()
+
+        # Fail fast while the payment circuit is open instead of waiting for SumUp timeouts
+        if not self.payment_service.is_available():
+            logger.error("Payment terminal not working, could not initiate the payment")
+            self.payment_unavailable()
+            return
         
         # Check if printer is ready before proceeding with payment
-        if not self.printer_service.is_printer_ready():
+        with tracing.span('is_printer_ready'):
+            printer_ready = self.printer_service.is_printer_ready()
+        if not printer_ready:
             logger.error("Cannot initiate payment - printer not ready")
+            self._report_device_failure('printer')
             self.payment_failed()
             return
         
         # Check if camera is ready before proceeding with payment
-        if not self.is_camera_ready():
+        with tracing.span('is_camera_ready'):
+            camera_ready = self.is_camera_ready()
+        if not camera_ready:
             logger.error("Cannot initiate payment - camera not ready")
+            self._report_device_failure('camera')
             self.payment_failed()
             return
 
@@ -139,11 +355,19 @@ class PhotoboothController:
         self.led_manager.set_button1_color(0.7, 0, 1)
 
         try:
-            transaction_id = self.payment_service.create_checkout()
+            with tracing.span('create_checkout') as span:
+                transaction_id = self.payment_service.create_checkout()
+                span['ok'] = bool(transaction_id)
             if transaction_id:
-                self.current_transaction_id = transaction_id
+                self.session.transaction_id = transaction_id
                 logger.info(f"Payment initiated with transaction ID: {transaction_id}")
-                threading.Timer(4.0, self.check_payment_status).start()
+                # The customer is busy with the card reader, time to wake the cameras
+                self.photo_service.start_prewarm(force_profile=self.capture_profile_mode == 'session')
+                # Polling gives the customer a head start, the webhook is waited on right away
+                threading.Timer(0 if self.payment_webhook else 4.0, self.check_payment_status).start()
+            elif not self.payment_service.is_available():
+                logger.error("Payment terminal not working, could not initiate the payment")
+                self.payment_unavailable()
             else:
                 logger.error("Payment terminal not working, could not initiate the payment")
                 self.payment_failed()
@@ -153,14 +377,20 @@ class PhotoboothController:
             self.payment_failed()
 
     def check_payment_status(self):
-        if not self.current_transaction_id:
+        session = self.session
+        if not session or not session.transaction_id:
             self.payment_failed()
             return
         self._update_state(State.PAYMENT_CHECKING)
         try:
-            result = self.payment_service.poll_transaction_status(self.current_transaction_id)
-            status = result['status']
-            self.transaction_code = result.get('transaction_code')
+            with tracing.span('poll_transaction_status') as span:
+                result = self.payment_service.wait_for_transaction_status(session.transaction_id)
+                status = result['status']
+                span['ok'] = status == "SUCCESSFUL"
+
+            session.transaction_code = result.get('transaction_code')
+            if self._abort_if_requested(session):
+                return
 
             if status == "SUCCESSFUL":
                 self.payment_successful()
@@ -171,14 +401,21 @@ class PhotoboothController:
             self.payment_failed()
 
     def payment_successful(self):
-        if self.current_transaction_id:
+        session = self.session
+        if session.transaction_id:
             TRANSACTION_STATE.labels(
-                transaction_id=self.current_transaction_id,
+                transaction_id=session.transaction_id,
                 state='payment_successful_but_not_printed_yet'
             ).inc()
 
         self._update_state(State.PAYMENT_SUCCESS)
-        logger.info(f"Payment log: Transaction {self.transaction_code} - Payment successful, but not printed yet")
+        session.mark('payment_successful')
+        # Wait for the payment to be on disk, from here on a crash must not lose the session
+        self.journal.record(
+            session.session_id, PAYMENT_SUCCESSFUL, wait=True,
+            transaction_id=session.transaction_id, transaction_code=session.transaction_code
+        )
+        logger.info(f"Payment log: Transaction {session.transaction_code} - Payment successful, but not printed yet")
         self.led_manager.set_button1_color(0, 1, 0)
         self._update_state(State.PHOTO_PULSING)
         self.led_manager.set_pulse_color_button2(red=0.1, green=1.0, blue=1)
@@ -191,31 +428,47 @@ class PhotoboothController:
         self.led_manager.flash_button_red(5)
         self.reset_to_idle()
 
+    def payment_unavailable(self):
+        logger.error("Critical error: payment_circuit_open")
+        self._update_state(State.PAYMENT_FAILED)
+        self.led_manager.flash_button_amber(3)
+        self.reset_to_idle()
+
     def initiate_photo_capture(self):
         with self.photo_lock:
             if self.state not in [State.PHOTO_PULSING]:
                 logger.warning("Photo capture not available in the current state.")
                 return
+            self.photo_service.stop_prewarm()
             self.photo_service.kill_gphoto2_process()
             self._update_state(State.PHOTO_COUNTDOWN)
             self.led_manager.stop_pulsing_button2()
             self.led_manager.set_button2_color(1, 0, 1)
-            threading.Thread(target=self._countdown_and_capture, daemon=True).start()
+            threading.Thread(target=self._countdown_and_capture, args=(self.session,), daemon=True).start()
 
-    def _countdown_and_capture(self):
-        logger.info(f"Taking photo: {self.photo_service.current_photo_count + 1}")
+    def _countdown_and_capture(self, session):
+        if self._abort_if_requested(session):
+            return
+        logger.info(f"Taking photo: {session.frame_count + 1}")
 
-        for remaining in range(4, 0, -1):
-            time.sleep(0.97)
+        with tracing.span('countdown'):
+            for remaining in range(4, 0, -1):
+                time.sleep(0.97)
 
         self._update_state(State.PHOTO_TAKING)
-        photo_path = self.photo_service.take_photo()
+        with tracing.span('take_photo', photo=session.frame_count + 1) as span:
+            photo_path = self.photo_service.take_photo(session)
+            span['ok'] = bool(photo_path)
+        if self._abort_if_requested(session):
+            return
         if photo_path:
-            logger.info(f"Photo {self.photo_service.current_photo_count} taken and saved.")
+            logger.info(f"Photo {session.frame_count} taken and saved.")
+            session.mark(f"photo_{session.frame_count}")
+            self.journal.record(session.session_id, FRAME_CAPTURED, number=session.frame_count, path=photo_path)
 
             self._update_state(State.PHOTO_DOWNLOADING)
 
-            if self.photo_service.current_photo_count < self.photo_service.max_photos:
+            if session.frame_count < self.photo_service.max_photos:
                 self.led_manager.set_button2_color(1, 1, 0)
 
                 # Wait for 2 seconds
@@ -224,61 +477,168 @@ class PhotoboothController:
                 self.photo_service.kill_gphoto2_process()
                 self.sound_service.play_timer_audio()
                 self.led_manager.set_button2_color(1, 0, 1)  # Increase red to compensate for dimming factor
-                threading.Thread(target=self._countdown_and_capture, daemon=True).start()
+                threading.Thread(target=self._countdown_and_capture, args=(session,), daemon=True).start()
             else:
-                # Reset state when all photos are taken
-                self._update_state(State.PHOTO_COMPLETE)
-                self.led_manager.set_button2_color(0, 1, 0)
-                logger.info("All photos taken successfully!")
-
-                collage_path = self.photo_service.create_final_photo()
-                if collage_path:
-                    logger.info(f"Final collage created")
-                    if self.printer_service.print_collage(collage_path):
-                        if self.current_transaction_id:
-                            TRANSACTION_STATE.labels(
-                                transaction_id=self.current_transaction_id,
-                                state='print_successful'
-                            ).inc()
-                        logger.info(f"Payment log: Transaction {self.transaction_code} - Print also successful")
-                        self._update_state(State.PHOTO_PRINTED)
-                        self.led_manager.flash_button_green(5)
-                        self.reset_to_idle()
-                    else:
-                        logger.error("Critical error: print_failed")
-                        logger.error("Failed to print collage")
-                        self.led_manager.flash_button_red(10)
-                        self.reset_to_idle()
-                else:
-                    logger.error("Critical error: collage_creation_failed")
-                    logger.error("Failed to create final collage")
-                    self.led_manager.flash_button_red(10)
-                    self.reset_to_idle()
+                self._create_and_print_collage(session)
         else:
             logger.error("Critical error: photo_capture_failed")
             logger.error("Failed to take/download photo.")
+            self._report_device_failure('camera')
             self._update_state(State.PHOTO_TAKING_FAILED)
             self.led_manager.flash_button_red(10)
-            self.reset_to_idle()
+            self.reset_to_idle(session)
 
-    def reset_to_idle(self):
-        self.cleanup_photos_directory()
-        self.current_transaction_id = None
-        self.transaction_code = None
+    def _create_and_print_collage(self, session):
+        if self._abort_if_requested(session):
+            return
+        # Reset state when all photos are taken
+        self._update_state(State.PHOTO_COMPLETE)
+        self.led_manager.set_button2_color(0, 1, 0)
+        logger.info("All photos taken successfully!")
+
+        with tracing.span('create_final_photo') as span:
+            collage_path = self.photo_service.create_final_photo(session)
+            span['ok'] = bool(collage_path)
+        if collage_path:
+            logger.info(f"Final collage created")
+            session.mark('collage_created')
+            self.journal.record(session.session_id, COLLAGE_CREATED, path=collage_path)
+            self._print_final_collage(session)
+        else:
+            logger.error("Critical error: collage_creation_failed")
+            logger.error("Failed to create final collage")
+            self.led_manager.flash_button_red(10)
+            self.reset_to_idle(session)
+
+    def _print_final_collage(self, session):
+        if self._abort_if_requested(session):
+            return
+        self._update_state(State.PHOTO_PRINTING)
+        self.journal.record(session.session_id, PRINT_SUBMITTED)
+        if self.animation_service:
+            # Encoded in the background while the printer works
+            self.animation_service.submit(session)
+        with tracing.span('print_collage') as span:
+            printed = self.printer_service.print_collage(session)
+            span['ok'] = printed
+        if printed:
+            session.mark('printed')
+            self.journal.record(session.session_id, PRINT_COMPLETED)
+            if session.transaction_id:
+                TRANSACTION_STATE.labels(
+                    transaction_id=session.transaction_id,
+                    state='print_successful'
+                ).inc()
+            logger.info(f"Payment log: Transaction {session.transaction_code} - Print also successful")
+            self._update_state(State.PHOTO_PRINTED)
+            self.led_manager.flash_button_green(5)
+            self.reset_to_idle(session)
+        else:
+            logger.error("Critical error: print_failed")
+            logger.error("Failed to print collage")
+            self._report_device_failure('printer')
+            reprint_config = self.config.get('reprint', {})
+            if reprint_config.get('buttonGesture', False):
+                retry_window = reprint_config.get('retryWindowSeconds', 300)
+                self.failed_print = (session.transaction_code or session.session_id, time.monotonic() + retry_window)
+            self.led_manager.flash_button_red(10)
+            self.reset_to_idle(session)
+
+    def resume_interrupted_session(self):
+        """
+        Continue the last paid session that was cut short by a crash or restart, from its last
+        durable step. Returns True if a session was resumed.
+        """
+        open_sessions = self.journal.open_sessions()
+        for session in open_sessions[:-1]:
+            logger.error(f"Critical error: interrupted_session_dropped - session {session['session']}, transaction {session['transaction_code']}")
+        self.journal.compact(keep_sessions=[session['session'] for session in open_sessions[-1:]])
+        if not open_sessions:
+            return False
+
+        journaled = open_sessions[-1]
+        session = Session(journaled['session'], journaled['transaction_id'], journaled['transaction_code'])
+        self.session = session
+        tracing.start_session(session.session_id)
+        logger.info(f"Resuming interrupted session {session.session_id} for transaction {session.transaction_code}")
+
+        collage_path = journaled['collage_path']
+        if collage_path and os.path.exists(collage_path):
+            session.collage_path = collage_path
+        else:
+            # Keep the frames that made it to disk in order, drop anything after the first gap
+            for path in journaled['frames']:
+                if not os.path.exists(path):
+                    break
+                session.add_frame(path)
+        # Anything in photos_dir the journal doesn't know about is a partial download
+        for file in os.listdir(self.photo_service.photos_dir):
+            file_path = os.path.join(self.photo_service.photos_dir, file)
+            if os.path.isfile(file_path) and file_path not in session.artifacts():
+                os.remove(file_path)
+
+        if session.collage_path:
+            self._update_state(State.PHOTO_COMPLETE)
+            threading.Thread(target=self._print_final_collage, args=(session,), daemon=True).start()
+        elif session.frame_count >= self.photo_service.max_photos:
+            threading.Thread(target=self._create_and_print_collage, args=(session,), daemon=True).start()
+        else:
+            # Wait for the customer to press button 2 for the remaining photos
+            self.led_manager.set_button1_color(0, 1, 0)
+            self._update_state(State.PHOTO_PULSING)
+            self.led_manager.set_pulse_color_button2(red=0.1, green=1.0, blue=1)
+            self.led_manager.start_pulsing_button2()
+        return True
+
+    def reset_to_idle(self, session=None):
+        """
+        Args:
+            session (Session): The session the caller works on. If another session has taken its
+                place meanwhile, the reset is skipped so it cannot end the new one.
+        """
+        if session is not None and session is not self.session:
+            logger.info(f"Skipping reset for session {session.session_id}, it is no longer current")
+            return
+        session, self.session = self.session, None
+        if session:
+            self.journal.record(session.session_id, SESSION_CLOSED, state=self.state.name)
+            try:
+                session.remove_artifacts()
+            except Exception as e:
+                logger.error(f"Error cleaning up session files: {e}")
+        self.photo_service.stop_prewarm()
         self._update_state(State.IDLE)
-        self.photo_service.reset_photo_count()
         self.led_manager.start_pulsing_button1()
         self.led_manager.stop_pulsing_button2()
         self.led_manager.set_button2_color(0, 0, 0)
+        tracing.end_session()
         logger.info("System reset to idle state.")
 
     def run(self):
         try:
             logger.info("Photobooth controller starting...")
-            # Start Prometheus metrics server first
-            start_http_server(8000)
-            # Then initialize the system
-            self.reset_to_idle()
+            # Start Prometheus metrics export first
+            metrics_config = self.config.get('metrics', {})
+            metrics.start_metrics_export(
+                'controller',
+                mode=metrics_config.get('mode', 'http'),
+                port=metrics_config.get('port', 8000),
+                textfile_directory=metrics_config.get('textfileDirectory'),
+                interval=metrics_config.get('interval', 15)
+            )
+            self.printer_service.start_media_sampling(metrics_config.get('mediaSampleInterval', 60))
+            if self.payment_webhook:
+                self.payment_webhook.start()
+            if self.device_recovery:
+                self.device_recovery.start()
+            if self.gallery:
+                self.gallery.start(self.config.get('gallery', {}).get('port', 8001))
+            # Setting a profile takes a gphoto2 call per setting, the booth does not wait for it
+            self.photo_service.apply_capture_profile_in_background()
+            # Then initialize the system, picking up a paid session a crash interrupted
+            if not self.resume_interrupted_session():
+                self.cleanup_photos_directory()
+                self.reset_to_idle()
 
             while True:
                 time.sleep(0.1)
@@ -297,6 +657,7 @@ class PhotoboothController:
             self.led_manager.stop_pulsing_button2()
             self.led_manager.set_button1_color(0, 0, 0)
             self.led_manager.set_button2_color(0, 0, 0)
+            tracing.shutdown()
             sys.exit(0)
 
 if __name__ == "__main__":
@@ -0,0 +1,151 @@
+"""
+Print Imposition
+Knows the DS-RX1 media sizes and cut modes, and packs pending images onto as few sheets as possible
+"""
+
+import logging
+from PIL import Image
+
+logger = logging.getLogger('PrintImposition')
+logger.setLevel(logging.INFO)
+
+# A slot is one 4x6 landscape area of the sheet at 300 dpi. It holds either one 4x6 print
+# or two 2x6 strips stacked on top of each other.
+SLOT_SIZE = (1842, 1240)
+
+# Media loaded in the DS-RX1. 'slots' is how many 4x6 areas fit on one sheet and 'page_sizes'
+# maps the number of used slots to the PageSize the DNP driver expects (the -div2 sizes make
+# the printer cut the sheet in half). The driver has no page size that cuts a 6x8 sheet into
+# strips, so a slot of strips is always printed on its own with 'strip_page_size'.
+MEDIA = {
+    '4x6': {
+        'slots': 1,
+        'page_sizes': {1: 'w288h432'},
+        'strip_page_size': 'w288h432-div2',
+    },
+    '6x8': {
+        'slots': 2,
+        'page_sizes': {1: 'w288h432', 2: 'w432h576-div2'},
+        'strip_page_size': 'w288h432-div2',
+    },
+}
+
+# Images at least this many times longer than wide are treated as 2x6 strips
+STRIP_ASPECT_RATIO = 2.5
+
+
+class Sheet:
+    def __init__(self, media):
+        self.media = media
+        self.slots = []  # each slot is a list with one print path or up to two strip paths
+        self.strip_slots = set()
+        self.cut_into_strips = False
+
+    @property
+    def images(self):
+        return [path for slot in self.slots for path in slot]
+
+    @property
+    def capacity(self):
+        """Slots this sheet can hold, a sheet of strips holds one slot so the strips get cut apart."""
+        return 1 if self.strip_slots else MEDIA[self.media]['slots']
+
+    def is_full(self):
+        if len(self.slots) < self.capacity:
+            return False
+        return all(len(slot) == 2 for i, slot in enumerate(self.slots) if i in self.strip_slots)
+
+    @property
+    def options(self):
+        """CUPS job options selecting the page size and cut mode for this sheet."""
+        media = MEDIA[self.media]
+        if len(self.slots) == 1 and self.cut_into_strips:
+            page_size = media['strip_page_size']
+        else:
+            page_size = media['page_sizes'][len(self.slots)]
+        return {'PageSize': page_size}
+
+    @property
+    def size(self):
+        width, height = SLOT_SIZE
+        return width, height * len(self.slots)
+
+
+class PrintImposer:
+    def __init__(self, media='4x6', split_collage_into_strips=False):
+        if media not in MEDIA:
+            raise ValueError(f"Unknown media '{media}', expected one of {', '.join(MEDIA)}")
+        self.media = media
+        self.split_collage_into_strips = split_collage_into_strips
+
+    @property
+    def slots_per_sheet(self):
+        return MEDIA[self.media]['slots']
+
+    def is_strip(self, image_path):
+        with Image.open(image_path) as image:
+            long_side, short_side = max(image.size), min(image.size)
+        return long_side >= short_side * STRIP_ASPECT_RATIO
+
+    def plan(self, image_paths):
+        """
+        Pack images onto sheets in the given order.
+
+        Strips share a slot in pairs on a sheet of their own, 4x6 prints take a whole slot. The last sheet may be
+        partially filled, callers that can wait for more images should check Sheet.is_full().
+
+        Returns:
+            list: Sheet objects ready for render().
+        """
+        sheets = []
+        open_strip_slot = None
+        for path in image_paths:
+            if self.is_strip(path):
+                if open_strip_slot is not None:
+                    open_strip_slot.append(path)
+                    open_strip_slot = None
+                    continue
+                sheet = self._sheet_with_free_slot(sheets, strip=True)
+                slot = [path]
+                sheet.strip_slots.add(len(sheet.slots))
+                sheet.slots.append(slot)
+                sheet.cut_into_strips = True
+                open_strip_slot = slot
+            else:
+                sheet = self._sheet_with_free_slot(sheets)
+                sheet.slots.append([path])
+                # The collage already holds two identical strips, the printer can cut them apart
+                sheet.cut_into_strips = self.split_collage_into_strips and len(sheet.slots) == 1
+        return sheets
+
+    def _sheet_with_free_slot(self, sheets, strip=False):
+        # Strips need a sheet of their own, the cut between them would cut a print on the same sheet
+        if not strip:
+            for sheet in sheets:
+                if not sheet.strip_slots and len(sheet.slots) < sheet.capacity:
+                    return sheet
+        sheets.append(Sheet(self.media))
+        return sheets[-1]
+
+    def render(self, sheet):
+        """Letterbox every image of the sheet into its slot on a white canvas."""
+        canvas = Image.new("RGB", sheet.size, "white")
+        slot_width, slot_height = SLOT_SIZE
+        for index, slot in enumerate(sheet.slots):
+            top = index * slot_height
+            if index in sheet.strip_slots:
+                strip_height = slot_height // 2
+                for position, path in enumerate(slot):
+                    self._paste_fitted(canvas, path, (0, top + position * strip_height, slot_width, strip_height))
+            else:
+                self._paste_fitted(canvas, slot[0], (0, top, slot_width, slot_height))
+        return canvas
+
+    def _paste_fitted(self, canvas, path, box):
+        left, top, width, height = box
+        with Image.open(path) as image:
+            if image.width < image.height:
+                image = image.rotate(-90, expand=True)
+            image.thumbnail((width, height), Image.LANCZOS)
+            offset = (left + (width - image.width) // 2, top + (height - image.height) // 2)
+            canvas.paste(image, offset)
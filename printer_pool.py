@@ -0,0 +1,165 @@
+"""
+Printer Pool
+Spreads print jobs over several CUPS queues, picking the least busy printer that still has media
+"""
+
+import threading
+import time
+import logging
+from prometheus_client import Counter, Gauge
+
+logger = logging.getLogger('PrinterPool')
+logger.setLevel(logging.INFO)
+
+PRINTER_JOBS = Counter('printer_jobs_total', 'Print jobs per printer and outcome', ['printer', 'result'])
+PRINTER_ACTIVE_JOBS = Gauge('printer_active_jobs', 'Jobs queued or printing per printer', ['printer'], multiprocess_mode='livemax')
+PRINTER_PRINTS_REMAINING = Gauge('printer_prints_remaining', 'Number of prints remaining per printer', ['printer'], multiprocess_mode='livemax')
+PRINTER_PRINTS_REMAINING_PERCENT = Gauge('printer_prints_remaining_percent', 'Percent of prints remaining per printer', ['printer'], multiprocess_mode='livemax')
+PRINTER_AVAILABLE = Gauge('printer_available', 'Whether the printer can take new jobs (1) or not (0)', ['printer'], multiprocess_mode='livemax')
+
+# IPP printer-state values
+PRINTER_IDLE = 3
+PRINTER_PROCESSING = 4
+PRINTER_STOPPED = 5
+
+
+def parse_media(printer_info):
+    """
+    Read the remaining media from the DNP marker attributes.
+
+    Returns:
+        tuple: (prints remaining or None if unknown, percent remaining or None if unknown)
+    """
+    prints_remaining = None
+    marker_message = printer_info.get('marker-message', '')
+    if marker_message:
+        count = marker_message.split(' ')[0]
+        prints_remaining = int(count) if count.isdigit() else 0
+
+    percent_remaining = None
+    marker_levels = printer_info.get('marker-levels', [])
+    if marker_levels:
+        percent_remaining = marker_levels[0]
+    return prints_remaining, percent_remaining
+
+
+class PrinterPool:
+    def __init__(self, conn, printer_names, prints_per_job=1, failure_cooldown=120):
+        if not printer_names:
+            raise ValueError('printer pool needs at least one printer')
+        self.conn = conn
+        self.printer_names = list(printer_names)
+        self.prints_per_job = prints_per_job
+        # A printer that failed a job is skipped for this many seconds before it gets another chance
+        self.failure_cooldown = failure_cooldown
+        self.failed_until = {name: 0 for name in self.printer_names}
+        self.media = {name: (None, None) for name in self.printer_names}
+        self.lock = threading.Lock()
+
+    def refresh_media(self):
+        """Read media levels of every printer and update the per-printer gauges."""
+        for name in self.printer_names:
+            try:
+                prints_remaining, percent_remaining = parse_media(self.conn.getPrinterAttributes(name))
+            except Exception as e:
+                logger.error(f"Error reading media of printer {name}: {e}")
+                continue
+            with self.lock:
+                self.media[name] = (prints_remaining, percent_remaining)
+            if prints_remaining is not None:
+                PRINTER_PRINTS_REMAINING.labels(printer=name).set(prints_remaining)
+            if percent_remaining is not None:
+                PRINTER_PRINTS_REMAINING_PERCENT.labels(printer=name).set(percent_remaining)
+        with self.lock:
+            return dict(self.media)
+
+    def total_prints_remaining(self):
+        with self.lock:
+            return sum(prints for prints, _ in self.media.values() if prints is not None)
+
+    def _active_jobs(self):
+        counts = {name: 0 for name in self.printer_names}
+        jobs = self.conn.getJobs(which_jobs='not-completed', requested_attributes=['job-printer-uri'])
+        for job in jobs.values():
+            printer = job.get('job-printer-uri', '').rsplit('/', 1)[-1]
+            if printer in counts:
+                counts[printer] += 1
+        for name, count in counts.items():
+            PRINTER_ACTIVE_JOBS.labels(printer=name).set(count)
+        return counts
+
+    def available_printers(self, exclude=()):
+        """
+        Printers that can take a job right now, least busy first.
+
+        A printer is available when it is not stopped, not cooling down after a failure and
+        has enough media for a job (unknown media counts as enough). The cooldown only moves
+        jobs to other printers: when every ready printer is cooling down, the one that failed
+        longest ago is returned, so a single printer is never locked out.
+        """
+        now = time.time()
+        try:
+            active_jobs = self._active_jobs()
+        except Exception as e:
+            logger.error(f"Error reading print queues: {e}")
+            active_jobs = {name: 0 for name in self.printer_names}
+
+        candidates = []
+        cooling = []  # (failed until, name) of ready printers that are only held back by the cooldown
+        for name in self.printer_names:
+            available = False
+            try:
+                printer_info = self.conn.getPrinterAttributes(name)
+                printer_state = printer_info.get('printer-state', 0)
+                prints_remaining, percent_remaining = parse_media(printer_info)
+                with self.lock:
+                    self.media[name] = (prints_remaining, percent_remaining)
+
+                with self.lock:
+                    failed_until = self.failed_until[name]
+
+                if name in exclude:
+                    pass
+                elif printer_state not in (PRINTER_IDLE, PRINTER_PROCESSING):
+                    logger.error(f"Printer {name} not ready. Current state: {printer_state}")
+                elif prints_remaining is not None and prints_remaining < self.prints_per_job:
+                    logger.error(f"Printer {name} is out of media")
+                elif failed_until > now:
+                    cooling.append((failed_until, name))
+                else:
+                    available = True
+                    candidates.append((active_jobs[name], printer_state != PRINTER_IDLE, -(prints_remaining or 0), name))
+            except Exception as e:
+                logger.error(f"Error checking printer {name}: {e}")
+            PRINTER_AVAILABLE.labels(printer=name).set(1 if available else 0)
+
+        if candidates:
+            for _, name in cooling:
+                logger.info(f"Printer {name} skipped, cooling down after a failed job")
+            return [name for *_, name in sorted(candidates)]
+        if cooling:
+            _, name = min(cooling)
+            logger.warning(f"Every ready printer is cooling down after a failed job, using {name}")
+            PRINTER_AVAILABLE.labels(printer=name).set(1)
+            return [name]
+        return []
+
+    def select_printer(self, exclude=()):
+        """Return the least busy available printer, or None if every printer is out of service."""
+        printers = self.available_printers(exclude)
+        return printers[0] if printers else None
+
+    def report_success(self, name):
+        PRINTER_JOBS.labels(printer=name, result='success').inc()
+        self.clear_failure(name)
+
+    def report_failure(self, name):
+        PRINTER_JOBS.labels(printer=name, result='failure').inc()
+        with self.lock:
+            self.failed_until[name] = time.time() + self.failure_cooldown
+        logger.error(f"Printer {name} failed a job, preferring other printers for {self.failure_cooldown}s")
+
+    def clear_failure(self, name):
+        """Give a printer a new chance right away instead of after the failure cooldown."""
+        with self.lock:
+            self.failed_until[name] = 0
@@ -3,24 +3,60 @@ import cups
 import shutil
 import tempfile
 import logging
-from PIL import Image
 from datetime import datetime
 import time
-from prometheus_client import Gauge
+from prometheus_client import Gauge, Histogram
 
-PRINTS_REMAINING = Gauge('prints_remaining', 'Number of prints remaining in the printer')
-PRINTS_REMAINING_PERCENT = Gauge('prints_remaining_percent', 'Percent of prints remaining in the printer')
+from print_imposition import PrintImposer
+from color_management import ColorManager
+from printer_pool import PrinterPool
+import pwg_raster
+import tracing
+import metrics
+
+# Only the controller samples media, livemax keeps a single series in multiprocess mode
+PRINTS_REMAINING = Gauge('prints_remaining', 'Number of prints remaining in the printer', multiprocess_mode='livemax')
+PRINTS_REMAINING_PERCENT = Gauge('prints_remaining_percent', 'Percent of prints remaining in the printer', multiprocess_mode='livemax')
+PRINT_PREPARE_SECONDS = Histogram(
+    'print_prepare_seconds', 'Time to render the print file per print mode', ['mode'],
+    buckets=(0.1, 0.25, 0.5, 1, 1.5, 2, 3, 5, 8)
+)
+# Covers the CUPS filter chain, which the pwg and raw modes skip
+PRINT_START_SECONDS = Histogram(
+    'print_start_seconds', 'Time from job submission until the printer is printing per print mode', ['mode'],
+    buckets=(0.5, 1, 2, 3, 4, 5, 7.5, 10, 15, 20)
+)
+
+PRINT_MODES = ('jpeg', 'pwg', 'raw')
 
 
 logger = logging.getLogger('PrinterService')
 logger.setLevel(logging.INFO)
 
 class PrinterService:
-    def __init__(self):
-        self.printer_name = "Dai_Nippon_Printing_DS-RX1"
+    def __init__(self, printer_names=None, media='4x6', split_collage_into_strips=False, icc_profile=None, rendering_intent='perceptual', gallery=None,
+                 print_mode='jpeg', dpi=300, reprint_cache=None):
+        """
+        Args:
+            print_mode (str): 'jpeg' hands CUPS a JPEG and lets its filters rasterise it, 'pwg' sends
+                PWG raster at device resolution so CUPS only runs the driver, and 'raw' sends the
+                PWG raster untouched to the backend, for queues whose printer reads PWG itself.
+            dpi (int): Device resolution for the pwg and raw modes.
+            reprint_cache (ReprintCache): Keeps each printed file for reprint(), or None.
+        """
+        if print_mode not in PRINT_MODES:
+            raise ValueError(f"Unknown print mode '{print_mode}', expected one of {', '.join(PRINT_MODES)}")
+        self.print_mode = print_mode
+        self.dpi = dpi
+        self.printer_names = printer_names or ["Dai_Nippon_Printing_DS-RX1"]
         self.conn = cups.Connection()
+        self.printer_pool = PrinterPool(self.conn, self.printer_names)
+        self.imposer = PrintImposer(media=media, split_collage_into_strips=split_collage_into_strips)
+        self.color_manager = ColorManager(printer_profile=icc_profile, rendering_intent=rendering_intent)
         self.temp_directory = tempfile.mkdtemp()
         self.archive_directory = "archive"
+        self.gallery = gallery
+        self.reprint_cache = reprint_cache
 
         # Create archive directory if it doesn't exist
         if not os.path.exists(self.archive_directory):
@@ -28,14 +64,90 @@ class PrinterService:
             logger.info(f"Created archive directory: {self.archive_directory}")
 
 
-    def print_collage(self, collage_path):
+    def print_collage(self, session):
+        collage_path = session.collage_path
         try:
             # Process and prepare the image
-            temp_file = self.process_image_for_printing(collage_path)
+            start_time = time.time()
+            with tracing.span('process_image_for_printing', mode=self.print_mode):
+                temp_file, print_options = self.process_image_for_printing(collage_path)
+            PRINT_PREPARE_SECONDS.labels(mode=self.print_mode).observe(time.time() - start_time)
+            session.print_path = temp_file
+        except Exception as e:
+            logger.error(f"Error printing collage: {e}")
+            return False
+
+        if not self._print_with_failover(temp_file, print_options):
+            if self.reprint_cache:
+                # Kept so staff can retry this print once the printer works again
+                self.reprint_cache.put(session.transaction_code or session.session_id, temp_file, print_options)
+            return False
+
+        if self.reprint_cache:
+            self.reprint_cache.put(session.transaction_code or session.session_id, temp_file, print_options)
 
+        try:
+            # Update print counts after successful print
+            self.update_remaining_print_count()
+
+            # Archive the collage
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            archive_filename = f"collage_{timestamp}.jpg"
+            archive_path = os.path.join(self.archive_directory, archive_filename)
+            shutil.copy2(collage_path, archive_path)
+            logger.info(f"Collage archived to: {archive_path}")
+            if self.gallery:
+                self.gallery.add(archive_path)
+
+            # Clean up the session's photos, collage and temp file
+            session.remove_artifacts()
+            logger.info("Temporary files cleaned up")
+        except Exception as e:
+            logger.error(f"Error archiving collage: {e}")
+
+        return True
+
+    def reprint(self, transaction_code=None):
+        """
+        Send a cached print-ready file to the printer again, without any image processing.
+
+        Args:
+            transaction_code (str): Transaction to reprint, None reprints the last print.
+        """
+        cached = self.reprint_cache.get(transaction_code) if self.reprint_cache else None
+        if cached is None:
+            logger.error(f"No cached print to reprint for transaction {transaction_code or '(last)'}")
+            return False
+        print_file, print_options = cached
+        logger.info(f"Reprinting {print_file}")
+        if not self._print_with_failover(print_file, print_options, mode='reprint'):
+            return False
+        self.update_remaining_print_count()
+        return True
+
+    def _print_with_failover(self, print_file, print_options, mode=None):
+        """Fail over to the next printer in the pool until one prints the file."""
+        tried_printers = []
+        while True:
+            printer_name = self.printer_pool.select_printer(exclude=tried_printers)
+            if printer_name is None:
+                logger.error(f"No printer left to print on, tried: {tried_printers}")
+                return False
+            tried_printers.append(printer_name)
+
+            if self._print_file(printer_name, print_file, print_options, mode):
+                self.printer_pool.report_success(printer_name)
+                return True
+            self.printer_pool.report_failure(printer_name)
+
+    def _print_file(self, printer_name, temp_file, print_options, mode=None):
+        """Submit the file to one printer and wait until it is printed. Returns False if the job failed."""
+        try:
             # Step 1: Submit job and verify it's in the queue
-            job_id = self.conn.printFile(self.printer_name, temp_file, "print_collage.jpg", {})
-            logger.info(f"Print job submitted with ID: {job_id}")
+            submitted_at = time.time()
+            with tracing.span('print_submit', printer=printer_name):
+                job_id = self.conn.printFile(printer_name, temp_file, os.path.basename(temp_file), print_options)
+            logger.info(f"Print job submitted to {printer_name} with ID: {job_id}")
 
             timeout = 10
             start_time = time.time()
@@ -43,32 +155,37 @@ class PrinterService:
                 jobs = self.conn.getJobs()
                 if job_id in jobs:
                     logger.info(f"Job {job_id} found in queue")
+                    tracing.record('print_queued', start_time, time.time(), printer=printer_name)
                     break
                 time.sleep(0.5)
             else:
                 logger.error("Job not found in queue")
+                tracing.record('print_queued', start_time, time.time(), ok=False, printer=printer_name)
                 self.conn.cancelJob(job_id)
                 return False
 
-            # Step 2: Verify printer is printing
+            # Step 2: Verify printer is printing. Only the job state counts, in a pool the printer
+            # state also reflects other jobs
             timeout = 20
             start_time = time.time()
             while time.time() - start_time < timeout:
-                printer_info = self.conn.getPrinterAttributes(self.printer_name)
-                printer_state = printer_info.get('printer-state', 0)
-                job_info = self.conn.getJobAttributes(job_id)
+                job_info = self.conn.getJobAttributes(job_id, requested_attributes=['job-state'])
                 job_state = job_info.get('job-state', 0)
 
-                if printer_state == 4 and job_state == cups.IPP_JOB_PROCESSING:
+                if job_state in (cups.IPP_JOB_PROCESSING, cups.IPP_JOB_COMPLETED):
                     logger.info("Printer is printing")
+                    tracing.record('print_start_processing', start_time, time.time(), printer=printer_name)
+                    PRINT_START_SECONDS.labels(mode=mode or self.print_mode).observe(time.time() - submitted_at)
                     break
                 elif job_state in [cups.IPP_JOB_HELD, cups.IPP_JOB_STOPPED, cups.IPP_JOB_CANCELED, cups.IPP_JOB_ABORTED]:
                     logger.error(f"Printer is not printing, job error state: {job_state}. Cancelling job")
+                    tracing.record('print_start_processing', start_time, time.time(), ok=False, printer=printer_name)
                     self.conn.cancelJob(job_id)
                     return False
                 time.sleep(1)
             else:
                 logger.error("Printer failed to start processing")
+                tracing.record('print_start_processing', start_time, time.time(), ok=False, printer=printer_name)
                 self.conn.cancelJob(job_id)
                 return False
 
@@ -76,49 +193,28 @@ class PrinterService:
             timeout = 40
             start_time = time.time()
             while time.time() - start_time < timeout:
-                printer_info = self.conn.getPrinterAttributes(self.printer_name)
-                printer_state = printer_info.get('printer-state', 0)
-                job_info = self.conn.getJobAttributes(job_id)
+                job_info = self.conn.getJobAttributes(job_id, requested_attributes=['job-state'])
                 job_state = job_info.get('job-state', 0)
 
-                if job_state == cups.IPP_JOB_COMPLETED and printer_state == 3:
+                # The printer may go straight on to the next job, so its state never has to be idle
+                if job_state == cups.IPP_JOB_COMPLETED:
                     logger.info("Print job completed successfully")
-
-                    # Update print counts after successful print
-                    self.update_remaining_print_count()
-
-                    # Archive the collage
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    archive_filename = f"collage_{timestamp}.jpg"
-                    archive_path = os.path.join(self.archive_directory, archive_filename)
-                    shutil.copy2(collage_path, archive_path)
-                    logger.info(f"Collage archived to: {archive_path}")
-
-                    # Clean up photos directory
-                    photos_dir = os.path.dirname(collage_path)
-                    for file in os.listdir(photos_dir):
-                        file_path = os.path.join(photos_dir, file)
-                        if os.path.isfile(file_path):
-                            os.remove(file_path)
-
-                    # Clean up temp file
-                    if os.path.exists(temp_file):
-                        os.remove(temp_file)
-                        logger.info("Temporary files cleaned up")
-
+                    tracing.record('print_complete', start_time, time.time(), printer=printer_name)
                     return True
                 elif job_state in [cups.IPP_JOB_HELD, cups.IPP_JOB_STOPPED, cups.IPP_JOB_CANCELED, cups.IPP_JOB_ABORTED]:
                     logger.error(f"Job entered error state: {job_state}")
+                    tracing.record('print_complete', start_time, time.time(), ok=False, printer=printer_name)
                     self.conn.cancelJob(job_id)
                     return False
                 time.sleep(1)
 
             logger.error("Print job timed out")
+            tracing.record('print_complete', start_time, time.time(), ok=False, printer=printer_name)
             self.conn.cancelJob(job_id)
             return False
 
         except Exception as e:
-            logger.error(f"Error printing collage: {e}")
+            logger.error(f"Error printing collage on {printer_name}: {e}")
             if 'job_id' in locals():
                 try:
                     self.conn.cancelJob(job_id)
@@ -127,57 +223,50 @@ class PrinterService:
             return False
 
     def process_image_for_printing(self, source_path):
-        temp_file = os.path.join(self.temp_directory, "print_collage.jpg")
-        shutil.copy2(source_path, temp_file)
-
-        image = Image.open(temp_file)
-        x, y = image.size
-
-        if x < y:
-            rotated_image = image.rotate(-90, expand=True)
+        """Render the collage onto a sheet for the loaded media, returns the file and its CUPS options."""
+        # Fill every slot with a copy, a single collage would leave half of a 6x8 sheet blank
+        sheet = self.imposer.plan([source_path] * self.imposer.slots_per_sheet)[0]
+        canvas = self.color_manager.apply(self.imposer.render(sheet))
+        options = sheet.options
+        if self.print_mode == 'jpeg':
+            temp_file = os.path.join(self.temp_directory, "print_collage.jpg")
+            canvas.save(temp_file)
         else:
-            rotated_image = image
-
-        new_width, new_height = 1842, 1240
-        rotated_image.thumbnail((new_width, new_height), Image.LANCZOS)
-        canvas = Image.new("RGB", (new_width, new_height), "white")
-        offset = ((new_width - rotated_image.width) // 2,
-                 (new_height - rotated_image.height) // 2)
-        canvas.paste(rotated_image, offset)
-        canvas.save(temp_file)
+            temp_file = os.path.join(self.temp_directory, "print_collage.pwg")
+            pwg_raster.write(canvas, temp_file, options['PageSize'], self.dpi)
+            if self.print_mode == 'raw':
+                options = dict(options, raw='true')
 
-        return temp_file
+        return temp_file, options
 
-    def update_remaining_print_count(self):
+    def update_remaining_print_count(self, printer_pool=None):
+        printer_pool = printer_pool or self.printer_pool
         try:
-            printer_info = self.conn.getPrinterAttributes(self.printer_name)
-            marker_message = printer_info.get('marker-message', '')
-            marker_levels = printer_info.get('marker-levels', [0])
+            media = printer_pool.refresh_media()
+            PRINTS_REMAINING.set(printer_pool.total_prints_remaining())
 
-            # Extract remaining prints count
-            if marker_message:
-                count = marker_message.split(' ')[0]
-                prints_remaining = int(count) if count.isdigit() else 0
-                PRINTS_REMAINING.set(prints_remaining)
+            # Percentage of the emptiest printer, that is the one that needs a new ribbon first
+            levels = [percent for _, percent in media.values() if percent is not None]
+            if levels:
+                PRINTS_REMAINING_PERCENT.set(min(levels))
 
-            # Extract percentage
-            if marker_levels and len(marker_levels) > 0:
-                PRINTS_REMAINING_PERCENT.set(marker_levels[0])
-
-            logger.info(f"Updated print metrics: {prints_remaining} prints remaining, {marker_levels[0]}% remaining")
+            logger.info(f"Updated print metrics: {media}")
         except Exception as e:
             logger.error(f"Error updating print counts: {e}")
 
+    def start_media_sampling(self, interval=60):
+        """Refresh the media gauges in the background, not only after a successful print."""
+        # pycups connections are not thread safe, the sampler gets its own
+        sampler_pool = PrinterPool(cups.Connection(), self.printer_names)
+        metrics.start_periodic(lambda: self.update_remaining_print_count(sampler_pool), interval, 'printer-media-sampler')
+
     def is_printer_ready(self):
-        """Check if printer is ready for printing (state 3 = idle)."""
+        """Check if at least one printer of the pool can take a job."""
         try:
-            printer_info = self.conn.getPrinterAttributes(self.printer_name)
-            printer_state = printer_info.get('printer-state', 0)
-            
-            if printer_state == 3:
+            if self.printer_pool.select_printer():
                 return True
             else:
-                logger.error(f"Printer not ready. Cannot start transaction Current state: {printer_state}")
+                logger.error("Printer not ready. Cannot start transaction, no printer in the pool is available")
                 return False
         except Exception as e:
             logger.error(f"Error checking printer readiness: {e}")
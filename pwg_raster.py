@@ -0,0 +1,133 @@
+"""
+PWG Raster
+Encodes print sheets as PWG raster (PWG 5102.4) at the printer's device resolution, so CUPS does not
+have to run its JPEG to PDF to raster filters for every print
+"""
+
+import re
+import struct
+import logging
+from PIL import Image
+
+logger = logging.getLogger('PwgRaster')
+logger.setLevel(logging.INFO)
+
+SYNC_WORD = b'RaS2'
+HEADER_SIZE = 1796
+
+COLOR_SPACE_SRGB = 19
+CUT_AFTER_PAGE = 4
+
+# Printable area in device pixels of the DS-RX1 at 300 dpi per PageSize, including the bleed the
+# driver adds around the nominal print size
+DEVICE_PAGE_SIZES = {
+    'w288h432': (1240, 1844),
+    'w288h432-div2': (1240, 1844),
+    'w432h576-div2': (1844, 2492),
+}
+
+
+def page_size_points(page_size):
+    """(width, height) in points from a PageSize name such as 'w288h432-div2'."""
+    match = re.match(r'w(\d+)h(\d+)', page_size)
+    if not match:
+        raise ValueError(f"Cannot read the size of PageSize '{page_size}'")
+    return int(match.group(1)), int(match.group(2))
+
+
+def fit_to_device(image, page_size, dpi=300):
+    """
+    Turn a rendered sheet into the printer's exact raster size and orientation.
+
+    The sheet is rotated if its orientation differs from the page and padded with white to the
+    device size. Only if it is more than 2% off is it resampled.
+    """
+    width_points, height_points = page_size_points(page_size)
+    device_size = DEVICE_PAGE_SIZES.get(page_size, (round(width_points * dpi / 72), round(height_points * dpi / 72)))
+    if (image.width > image.height) != (device_size[0] > device_size[1]):
+        image = image.rotate(90, expand=True)
+    if image.size == device_size:
+        return image
+    if abs(image.width - device_size[0]) > device_size[0] * 0.02 or abs(image.height - device_size[1]) > device_size[1] * 0.02:
+        logger.warning(f"Sheet is {image.width}x{image.height}, resampling to the device size {device_size[0]}x{device_size[1]}")
+        image.thumbnail(device_size, Image.LANCZOS)
+    page = Image.new('RGB', device_size, 'white')
+    page.paste(image, ((device_size[0] - image.width) // 2, (device_size[1] - image.height) // 2))
+    return page
+
+
+def _page_header(width, height, dpi, page_size, page_count):
+    width_points, height_points = page_size_points(page_size)
+    header = bytearray(HEADER_SIZE)
+    header[0:9] = b'PwgRaster'
+    header[1732:1732 + len(page_size)] = page_size.encode('ascii')[:63]
+    struct.pack_into('>I', header, 268, CUT_AFTER_PAGE)      # CutMedia
+    struct.pack_into('>II', header, 276, dpi, dpi)         # HWResolution
+    struct.pack_into('>I', header, 340, 1)                 # NumCopies
+    struct.pack_into('>II', header, 352, width_points, height_points)  # PageSize
+    struct.pack_into('>II', header, 372, width, height)    # Width, Height
+    struct.pack_into('>I', header, 384, 8)                 # BitsPerColor
+    struct.pack_into('>I', header, 388, 24)                # BitsPerPixel
+    struct.pack_into('>I', header, 392, width * 3)         # BytesPerLine
+    struct.pack_into('>I', header, 396, 0)                 # ColorOrder chunky
+    struct.pack_into('>I', header, 400, COLOR_SPACE_SRGB)  # ColorSpace
+    struct.pack_into('>I', header, 420, 3)                 # NumColors
+    struct.pack_into('>I', header, 452, page_count)        # TotalPageCount
+    struct.pack_into('>ii', header, 456, 1, 1)             # CrossFeedTransform, FeedTransform
+    struct.pack_into('>IIII', header, 464, 0, 0, width, height)  # ImageBox
+    return bytes(header)
+
+
+def _encode_line(line, width):
+    """
+    Encode one line in the PWG PackBits variant, counted in pixels.
+
+    Photographic lines hardly contain runs of identical pixels, searching for them costs far more
+    CPU than it saves bytes, so only single-colour lines (borders, margins) are run-length coded
+    and everything else goes out as 128-pixel literal chunks.
+    """
+    if line == line[:3] * width:
+        encoded = bytearray()
+        remaining = width
+        while remaining:
+            run = min(remaining, 128)
+            encoded.append(run - 1)
+            encoded += line[:3]
+            remaining -= run
+        return bytes(encoded)
+
+    encoded = bytearray()
+    for start in range(0, width, 128):
+        chunk = line[start * 3:(start + 128) * 3]
+        pixels = len(chunk) // 3
+        # A single pixel is a run of one, literals start at two pixels
+        encoded.append(0 if pixels == 1 else 257 - pixels)
+        encoded += chunk
+    return bytes(encoded)
+
+
+def encode(image, page_size, dpi=300):
+    """Return a one-page PWG raster document for an RGB image already at device size."""
+    image = image.convert('RGB')
+    width, height = image.size
+    data = image.tobytes()
+    line_size = width * 3
+    output = [SYNC_WORD, _page_header(width, height, dpi, page_size, 1)]
+
+    y = 0
+    while y < height:
+        line = data[y * line_size:(y + 1) * line_size]
+        # Identical following lines are sent once with a repeat count (up to 256 lines)
+        repeat = 1
+        while repeat < 256 and y + repeat < height and data[(y + repeat) * line_size:(y + repeat + 1) * line_size] == line:
+            repeat += 1
+        output.append(bytes([repeat - 1]))
+        output.append(_encode_line(line, width))
+        y += repeat
+    return b''.join(output)
+
+
+def write(image, path, page_size, dpi=300):
+    with open(path, 'wb') as file:
+        file.write(encode(fit_to_device(image, page_size, dpi), page_size, dpi))
+    return path
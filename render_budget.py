@@ -0,0 +1,120 @@
+"""
+Render Budget
+Picks how much effort the collage render may take, so it stays within a time budget when the Pi throttles
+"""
+
+import time
+import threading
+import subprocess
+import logging
+from collections import deque
+from PIL import Image
+from prometheus_client import Gauge, Histogram
+
+logger = logging.getLogger('RenderBudget')
+logger.setLevel(logging.INFO)
+
+RENDER_TIER = Gauge('render_tier', 'Collage render tier in use (0 is full quality, higher is cheaper)', multiprocess_mode='livemax')
+SOC_TEMPERATURE = Gauge('soc_temperature_celsius', 'SoC temperature read before a render', multiprocess_mode='livemax')
+SOC_THROTTLED = Gauge('soc_throttled', 'Whether the SoC is currently throttled or under-voltage (1) or not (0)', multiprocess_mode='livemax')
+COLLAGE_RENDER_SECONDS = Histogram(
+    'collage_render_seconds', 'Time to render the collage per tier', ['tier'],
+    buckets=(0.25, 0.5, 1, 1.5, 2, 3, 4, 6, 8, 12, 20)
+)
+
+THERMAL_ZONE = '/sys/class/thermal/thermal_zone0/temp'
+
+# From best to cheapest. draft_factor is how much larger than the tile the JPEG decoder must
+# decode, None decodes at full size.
+TIERS = [
+    {'name': 'full', 'resample': Image.LANCZOS, 'draft_factor': None, 'quality': 100, 'optimize': False},
+    {'name': 'balanced', 'resample': Image.BICUBIC, 'draft_factor': 2, 'quality': 95, 'optimize': False},
+    {'name': 'fast', 'resample': Image.BILINEAR, 'draft_factor': 1, 'quality': 90, 'optimize': False},
+]
+
+
+def read_temperature():
+    """SoC temperature in °C, or None where there is no thermal zone."""
+    try:
+        with open(THERMAL_ZONE, 'r') as file:
+            return int(file.read().strip()) / 1000
+    except (OSError, ValueError):
+        return None
+
+
+def read_throttled():
+    """
+    Whether the firmware currently throttles, caps the ARM frequency or sees under-voltage.
+
+    Returns:
+        bool: True if throttled now, False if not or if vcgencmd is not available.
+    """
+    try:
+        output = subprocess.run(['vcgencmd', 'get_throttled'], capture_output=True, text=True, timeout=2).stdout
+        # throttled=0x50005, bits 0-3 are the current state, the upper bits what happened since boot
+        return bool(int(output.strip().split('=')[1], 16) & 0xF)
+    except (OSError, IndexError, ValueError, subprocess.SubprocessError):
+        return False
+
+
+class RenderBudget:
+    def __init__(self, budget_seconds=3.0, temperature_limit=75.0, history_seconds=600, sensor_interval=5.0):
+        """
+        Args:
+            budget_seconds (float): Time a collage render should stay under.
+            temperature_limit (float): At or above this SoC temperature the full tier is not used.
+            history_seconds (float): Render timings older than this are forgotten, so a tier that
+                was too slow while hot gets another chance once the booth cooled down.
+            sensor_interval (float): How long a temperature and throttle reading is reused.
+        """
+        self.budget_seconds = budget_seconds
+        self.temperature_limit = temperature_limit
+        self.history_seconds = history_seconds
+        self.sensor_interval = sensor_interval
+        self.timings = {tier['name']: deque(maxlen=5) for tier in TIERS}
+        self.sensors = (0, None, False)
+        self.lock = threading.Lock()
+
+    def _read_sensors(self):
+        read_at, temperature, throttled = self.sensors
+        if time.time() - read_at > self.sensor_interval:
+            temperature, throttled = read_temperature(), read_throttled()
+            self.sensors = (time.time(), temperature, throttled)
+            if temperature is not None:
+                SOC_TEMPERATURE.set(temperature)
+            SOC_THROTTLED.set(1 if throttled else 0)
+        return temperature, throttled
+
+    def _recent_seconds(self, tier):
+        """Median of the tier's recent render times, or None if it has no recent timings."""
+        cutoff = time.time() - self.history_seconds
+        with self.lock:
+            recent = sorted(seconds for finished, seconds in self.timings[tier['name']] if finished >= cutoff)
+        return recent[len(recent) // 2] if recent else None
+
+    def choose(self):
+        """Return the best tier that the sensors allow and whose recent renders fit the budget."""
+        temperature, throttled = self._read_sensors()
+        first = 0
+        if throttled or (temperature is not None and temperature >= self.temperature_limit):
+            first = 1
+
+        index = len(TIERS) - 1
+        for candidate in range(first, len(TIERS)):
+            recent = self._recent_seconds(TIERS[candidate])
+            if recent is None or recent <= self.budget_seconds:
+                index = candidate
+                break
+
+        tier = TIERS[index]
+        RENDER_TIER.set(index)
+        if index:
+            logger.info(f"Rendering collage at tier {tier['name']} (temperature {temperature}, throttled {throttled})")
+        return tier
+
+    def record(self, tier, seconds):
+        with self.lock:
+            self.timings[tier['name']].append((time.time(), seconds))
+        COLLAGE_RENDER_SECONDS.labels(tier=tier['name']).observe(seconds)
+        if seconds > self.budget_seconds:
+            logger.warning(f"Collage render at tier {tier['name']} took {seconds:.2f}s, over the {self.budget_seconds}s budget")
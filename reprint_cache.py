@@ -0,0 +1,148 @@
+"""
+Reprint Cache
+Keeps the print-ready file of recent sessions, so a reprint goes straight to the printer
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import threading
+import logging
+
+logger = logging.getLogger('ReprintCache')
+logger.setLevel(logging.INFO)
+
+INDEX_FILE = 'index.json'
+
+
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ReprintCache:
+    def __init__(self, directory='reprint_cache', max_mb=300):
+        self.directory = directory
+        self.max_bytes = max_mb * 1024 * 1024
+        self.lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self.entries = self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(os.path.join(self.directory, INDEX_FILE), 'r') as file:
+                entries = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        # Drop entries whose file went missing
+        return {key: entry for key, entry in entries.items() if os.path.isfile(os.path.join(self.directory, entry['file']))}
+
+    def _save_index(self):
+        temp_path = os.path.join(self.directory, INDEX_FILE + '.tmp')
+        with open(temp_path, 'w') as file:
+            json.dump(self.entries, file)
+        os.replace(temp_path, os.path.join(self.directory, INDEX_FILE))
+
+    def put(self, transaction_code, print_path, options):
+        """
+        Store a print-ready file with the CUPS options it was printed with.
+
+        Returns:
+            str: The cache key (transaction code and content hash), or None if storing failed.
+        """
+        try:
+            content_hash = file_hash(print_path)[:12]
+            key = f"{transaction_code}_{content_hash}"
+            filename = key + os.path.splitext(print_path)[1]
+            with self.lock:
+                if key not in self.entries:
+                    shutil.copy2(print_path, os.path.join(self.directory, filename))
+                now = time.time()
+                self.entries[key] = {
+                    'file': filename, 'transaction_code': transaction_code, 'hash': content_hash,
+                    'options': options, 'size': os.path.getsize(print_path),
+                    'created': self.entries.get(key, {}).get('created', now), 'last_used': now,
+                }
+                self._evict()
+                self._save_index()
+            return key
+        except Exception as e:
+            logger.error(f"Error caching print file for transaction {transaction_code}: {e}")
+            return None
+
+    def _evict(self):
+        """Remove least recently used files until the cache fits its size limit."""
+        total = sum(entry['size'] for entry in self.entries.values())
+        for key in sorted(self.entries, key=lambda key: self.entries[key]['last_used']):
+            if total <= self.max_bytes or len(self.entries) == 1:
+                break
+            entry = self.entries.pop(key)
+            total -= entry['size']
+            try:
+                os.remove(os.path.join(self.directory, entry['file']))
+            except FileNotFoundError:
+                pass
+            logger.info(f"Evicted {key} from the reprint cache")
+
+    def get(self, transaction_code=None):
+        """
+        Look up the newest cached print of a transaction, or the newest print overall.
+
+        Returns:
+            tuple: (path, options), or None if nothing matches.
+        """
+        with self.lock:
+            candidates = [
+                (entry['created'], key) for key, entry in self.entries.items()
+                if transaction_code is None or entry['transaction_code'] == transaction_code
+            ]
+            if not candidates:
+                return None
+            _, key = max(candidates)
+            entry = self.entries[key]
+            entry['last_used'] = time.time()
+            self._save_index()
+            return os.path.join(self.directory, entry['file']), entry['options']
+
+    def list(self):
+        with self.lock:
+            return sorted(self.entries.values(), key=lambda entry: entry['created'])
+
+
+def main(argv=None):
+    from config_loader import load_config
+    from printer_service import PrinterService
+
+    parser = argparse.ArgumentParser(description='Reprint a cached collage')
+    parser.add_argument('--config', default='config.json')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('list', help='list cached prints')
+    reprint_parser = subparsers.add_parser('reprint', help='send a cached print to the printer')
+    reprint_parser.add_argument('transaction_code', nargs='?', help='transaction to reprint, the last print if omitted')
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    cache_config = config.get('reprint', {})
+    cache = ReprintCache(cache_config.get('directory', 'reprint_cache'), cache_config.get('maxMb', 300))
+
+    if args.command == 'list':
+        for entry in cache.list():
+            created = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['created']))
+            print(f"{created}  {entry['transaction_code']:<24} {entry['size'] / (1024 * 1024):6.1f} MB  {entry['file']}")
+        return 0
+
+    print_config = config.get('print', {})
+    printer_service = PrinterService(printer_names=print_config.get('printers'), reprint_cache=cache)
+    return 0 if printer_service.reprint(args.transaction_code) else 1
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    sys.exit(main())
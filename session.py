@@ -0,0 +1,51 @@
+"""
+Session
+Everything one customer run produces, handed from stage to stage instead of rediscovered on disk
+"""
+
+import os
+import time
+from datetime import datetime
+
+
+class Session:
+    __slots__ = (
+        'session_id', 'transaction_id', 'transaction_code', 'frames', 'spare_frames',
+        'collage_path', 'print_path', 'timings', 'started_at', 'aborted',
+    )
+
+    def __init__(self, session_id=None, transaction_id=None, transaction_code=None):
+        self.session_id = session_id or datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        self.transaction_id = transaction_id
+        self.transaction_code = transaction_code
+        self.frames = []        # primary camera frames, in shot order, these go into the collage
+        self.spare_frames = []  # frames from the other cameras
+        self.collage_path = None
+        self.print_path = None
+        self.timings = {}       # stage name -> time.time() when it was reached
+        self.started_at = time.time()
+        self.aborted = False    # set by a staff reset, the thread running the session resets at its next step
+
+    @property
+    def frame_count(self):
+        return len(self.frames)
+
+    def add_frame(self, path, spare_paths=()):
+        self.frames.append(path)
+        self.spare_frames.extend(spare_paths)
+
+    def mark(self, stage):
+        self.timings[stage] = time.time()
+
+    def artifacts(self):
+        """Every file this session created, for cleanup."""
+        paths = self.frames + self.spare_frames + [self.collage_path, self.print_path]
+        return [path for path in paths if path]
+
+    def remove_artifacts(self):
+        for path in self.artifacts():
+            if os.path.isfile(path):
+                os.remove(path)
+
+    def __repr__(self):
+        return f"Session({self.session_id}, transaction={self.transaction_code}, frames={self.frame_count})"
@@ -0,0 +1,147 @@
+"""
+Session Journal
+Append-only record of each paid session, so a crash or restart can resume instead of losing it
+"""
+
+import os
+import json
+import time
+import queue
+import threading
+import logging
+
+logger = logging.getLogger('SessionJournal')
+logger.setLevel(logging.INFO)
+
+# Events in the order a session goes through them
+SESSION_STARTED = 'session_started'
+PAYMENT_SUCCESSFUL = 'payment_successful'
+FRAME_CAPTURED = 'frame_captured'
+COLLAGE_CREATED = 'collage_created'
+PRINT_SUBMITTED = 'print_submitted'
+PRINT_COMPLETED = 'print_completed'
+SESSION_CLOSED = 'session_closed'
+
+FINAL_EVENTS = (PRINT_COMPLETED, SESSION_CLOSED)
+
+
+class SessionJournal:
+    def __init__(self, path='photobooth_journal.jsonl', commit_interval=0.2, max_kb=1024):
+        """
+        Args:
+            commit_interval (float): How long the writer collects records before one write and
+                fsync covers all of them.
+            max_kb (int): Once the journal grows past this size the writer drops finished sessions from it.
+        """
+        self.path = path
+        self.commit_interval = commit_interval
+        self.max_bytes = max_kb * 1024
+        self.pending = queue.Queue()
+        self.file_lock = threading.Lock()
+        self.file = open(self.path, 'a')
+        self.writer_thread = threading.Thread(target=self._writer, name='session-journal', daemon=True)
+        self.writer_thread.start()
+
+    def record(self, session_id, event, wait=False, **data):
+        """
+        Append an event for a session.
+
+        The record is written by the writer thread in the next group commit. With wait=True
+        the call returns only once the record is on disk, use it where losing the record
+        would cost the customer (the payment).
+        """
+        entry = {'session': session_id, 'event': event, 'time': time.time()}
+        entry.update(data)
+        committed = threading.Event() if wait else None
+        self.pending.put((entry, committed))
+        if committed and not committed.wait(5):
+            logger.error(f"Journal record {event} for session {session_id} not committed within 5 seconds")
+
+    def _writer(self):
+        while True:
+            batch = [self.pending.get()]
+            # Gather everything that arrives within the commit interval into one fsync, unless
+            # someone is waiting for their record
+            deadline = time.time() + self.commit_interval
+            while not any(committed for _, committed in batch):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                with self.file_lock:
+                    for entry, _ in batch:
+                        self.file.write(json.dumps(entry) + '\n')
+                    self.file.flush()
+                    os.fsync(self.file.fileno())
+                    size = self.file.tell()
+                if size >= self.max_bytes:
+                    self.compact(keep_sessions=[session['session'] for session in self._read_sessions() if not session['finished']])
+                    logger.info(f"Session journal compacted from {size // 1024} KB")
+            except Exception as e:
+                logger.error(f"Error writing session journal: {e}")
+
+            for _, committed in batch:
+                if committed:
+                    committed.set()
+
+    def open_sessions(self):
+        """
+        Read the journal and return the sessions that were paid but never finished.
+
+        Returns:
+            list: One dict per session, oldest first, with the session id, the payment details,
+                the captured frames in order, and the collage path if one was created.
+        """
+        return [session for session in self._read_sessions() if PAYMENT_SUCCESSFUL in session['events'] and not session['finished']]
+
+    def _read_sessions(self):
+        sessions = {}
+        try:
+            with open(self.path, 'r') as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A torn last line from a crash mid-write
+                        continue
+                    session = sessions.setdefault(entry['session'], {
+                        'session': entry['session'], 'events': [], 'frames': [], 'collage_path': None,
+                        'transaction_id': None, 'transaction_code': None,
+                    })
+                    session['events'].append(entry['event'])
+                    if entry['event'] in (SESSION_STARTED, PAYMENT_SUCCESSFUL):
+                        session['transaction_id'] = entry.get('transaction_id') or session['transaction_id']
+                        session['transaction_code'] = entry.get('transaction_code') or session['transaction_code']
+                    elif entry['event'] == FRAME_CAPTURED:
+                        session['frames'].append(entry['path'])
+                    elif entry['event'] == COLLAGE_CREATED:
+                        session['collage_path'] = entry['path']
+        except FileNotFoundError:
+            return []
+
+        for session in sessions.values():
+            session['finished'] = any(event in FINAL_EVENTS for event in session['events'])
+        return list(sessions.values())
+
+    def compact(self, keep_sessions=()):
+        """Rewrite the journal with only the records of the given sessions, dropping finished ones."""
+        keep_sessions = set(keep_sessions)
+        temp_path = self.path + '.tmp'
+        with self.file_lock:
+            with open(self.path, 'r') as source, open(temp_path, 'w') as target:
+                for line in source:
+                    try:
+                        if json.loads(line)['session'] in keep_sessions:
+                            target.write(line)
+                    except ValueError:
+                        continue
+                target.flush()
+                os.fsync(target.fileno())
+            os.replace(temp_path, self.path)
+            self.file.close()
+            self.file = open(self.path, 'a')
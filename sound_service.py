@@ -9,28 +9,46 @@ logger.setLevel(logging.INFO)
 
 class SoundService:
     def __init__(self, volume=1):
+        self.volume = volume
+        self.playback_failed = False
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        self.audio_file = os.path.join(script_dir, 'timer_audio.wav')
         try:
             # Handle SIGTERM so we can gracefully shut down and free the audio device
             signal.signal(signal.SIGTERM, self._handle_termination)
             signal.signal(signal.SIGINT, self._handle_termination)
 
-            pygame.mixer.init()
-            pygame.mixer.music.set_volume(volume)
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            self.audio_file = os.path.join(script_dir, 'timer_audio.wav')
-            pygame.mixer.music.load(self.audio_file)
+            self._init_mixer()
         except Exception as e:
             logger.error(f"Failed to initialize sound service: {e}")
 
+    def _init_mixer(self):
+        pygame.mixer.init()
+        pygame.mixer.music.set_volume(self.volume)
+        pygame.mixer.music.load(self.audio_file)
+
+    def is_healthy(self):
+        """True if the mixer is open and the last playback worked."""
+        return pygame.mixer.get_init() is not None and not self.playback_failed
+
+    def restart(self):
+        """Close and reopen the mixer, for when the audio device was lost and came back."""
+        pygame.mixer.quit()
+        self._init_mixer()
+        self.playback_failed = False
+        logger.info("Sound mixer restarted")
+
     def play_timer_audio(self):
         try:
             pygame.mixer.music.play()
         except Exception as e:
+            self.playback_failed = True
             logger.error(f"Failed to play timer audio: {e}")
 
     def set_volume(self, volume):
         try:
             pygame.mixer.music.set_volume(volume)
+            self.volume = volume
             logger.info(f"Volume set to {volume}")
         except Exception as e:
             logger.error(f"Failed to set volume: {e}")
@@ -0,0 +1,202 @@
+"""
+Tracing
+Per-session latency spans written to a rotating JSON lines file, plus a CLI to read them back
+
+    python tracing.py timeline [--session ID] [--last N] [FILE]
+    python tracing.py summary [FILE]
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+import logging
+import logging.handlers
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger('Tracing')
+logger.setLevel(logging.INFO)
+
+DEFAULT_TRACE_FILE = 'photobooth_trace.jsonl'
+
+# Spans are handed to a queue and written by a listener thread, so recording one on the
+# shutter or print path is a dict build and a queue put
+_trace_logger = logging.getLogger('PhotoboothTrace')
+_trace_logger.propagate = False
+_trace_logger.setLevel(logging.INFO)
+_listener = None
+
+_session_lock = threading.Lock()
+_current_session = None
+
+
+def configure(trace_file=DEFAULT_TRACE_FILE, max_mb=10, backups=3):
+    """Start exporting spans to the given file. Until this is called spans are dropped."""
+    global _listener
+    if _listener:
+        return
+    file_handler = logging.handlers.RotatingFileHandler(trace_file, maxBytes=max_mb * 1024 * 1024, backupCount=backups)
+    file_handler.setFormatter(logging.Formatter('%(message)s'))
+    span_queue = queue.SimpleQueue()
+    _trace_logger.addHandler(logging.handlers.QueueHandler(span_queue))
+    _listener = logging.handlers.QueueListener(span_queue, file_handler)
+    _listener.start()
+    logger.info(f"Tracing spans to {trace_file}")
+
+
+def shutdown():
+    global _listener
+    if _listener:
+        _listener.stop()
+        _listener = None
+
+
+def start_session(session_id=None):
+    """Begin a new session, every span recorded until end_session() belongs to it."""
+    global _current_session
+    with _session_lock:
+        _current_session = session_id or datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        return _current_session
+
+
+def end_session():
+    global _current_session
+    with _session_lock:
+        _current_session = None
+
+
+def current_session():
+    return _current_session
+
+
+def record(name, start, end, ok=True, session=None, **attributes):
+    if not _listener:
+        return
+    span = {
+        'session': session or _current_session,
+        'span': name,
+        'start': round(start, 6),
+        'duration_ms': round((end - start) * 1000, 3),
+        'ok': ok,
+        'thread': threading.current_thread().name,
+    }
+    if attributes:
+        span['attributes'] = attributes
+    _trace_logger.info(json.dumps(span))
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Time the enclosed block. The span is marked as failed if the block raises, or if the
+    block sets 'ok' to False on the yielded attributes dict.
+    """
+    # The session may end inside the block, the span still belongs to it
+    session = _current_session
+    start = time.time()
+    ok = True
+    try:
+        yield attributes
+    except BaseException:
+        ok = False
+        raise
+    finally:
+        ok = attributes.pop('ok', True) and ok
+        record(name, start, time.time(), ok, session, **attributes)
+
+
+def read_spans(trace_file):
+    """Read spans from the trace file and its rotated backups, oldest first."""
+    paths = [trace_file]
+    index = 1
+    while os.path.exists(f"{trace_file}.{index}"):
+        paths.append(f"{trace_file}.{index}")
+        index += 1
+
+    spans = []
+    for path in reversed(paths):
+        if not os.path.exists(path):
+            continue
+        with open(path, 'r') as file:
+            for line in file:
+                try:
+                    spans.append(json.loads(line))
+                except ValueError:
+                    continue
+    spans.sort(key=lambda span: span['start'])
+    return spans
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def print_timeline(spans, session_id=None, last=5):
+    sessions = {}
+    for span in spans:
+        if span.get('session'):
+            sessions.setdefault(span['session'], []).append(span)
+    if session_id:
+        selected = [session_id] if session_id in sessions else []
+    else:
+        selected = list(sessions)[-last:]
+    if not selected:
+        print("No matching sessions found")
+        return
+
+    for session in selected:
+        session_spans = sessions[session]
+        session_start = session_spans[0]['start']
+        session_end = max(span['start'] + span['duration_ms'] / 1000 for span in session_spans)
+        print(f"Session {session}  {datetime.fromtimestamp(session_start):%Y-%m-%d %H:%M:%S}  total {session_end - session_start:.1f}s")
+        for span in session_spans:
+            offset = span['start'] - session_start
+            status = '' if span['ok'] else '  FAILED'
+            print(f"  +{offset:7.2f}s  {span['duration_ms'] / 1000:7.2f}s  {span['span']}{status}")
+        print()
+
+
+def print_summary(spans):
+    durations = {}
+    for span in spans:
+        durations.setdefault(span['span'], []).append(span['duration_ms'])
+    if not durations:
+        print("No spans found")
+        return
+
+    print(f"{'span':<36} {'count':>6} {'p50 ms':>10} {'p90 ms':>10} {'p99 ms':>10} {'max ms':>10}")
+    for name, values in sorted(durations.items(), key=lambda item: -percentile(item[1], 0.5)):
+        print(f"{name:<36} {len(values):>6} {percentile(values, 0.5):>10.1f} {percentile(values, 0.9):>10.1f} "
+              f"{percentile(values, 0.99):>10.1f} {max(values):>10.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Photobooth session latency report')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    timeline_parser = subparsers.add_parser('timeline', help='per-session timeline')
+    timeline_parser.add_argument('--session', help='session id to show')
+    timeline_parser.add_argument('--last', type=int, default=5, help='number of most recent sessions to show')
+    timeline_parser.add_argument('trace_file', nargs='?', default=DEFAULT_TRACE_FILE)
+    summary_parser = subparsers.add_parser('summary', help='percentile breakdown per span')
+    summary_parser.add_argument('trace_file', nargs='?', default=DEFAULT_TRACE_FILE)
+    args = parser.parse_args(argv)
+
+    spans = read_spans(args.trace_file)
+    if args.command == 'timeline':
+        print_timeline(spans, args.session, args.last)
+    else:
+        print_summary(spans)
+
+
+if __name__ == "__main__":
+    sys.exit(main())